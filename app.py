@@ -1,14 +1,34 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta, time
 import os
 from fpdf import FPDF
 import arabic_reshaper
 from bidi.algorithm import get_display
-from streamlit_autorefresh import st_autorefresh
 from gtts import gTTS
 import base64
 import requests
+import threading
+import bisect
+import sqlite3
+import shutil
+import importlib.util
+import copy
+import hashlib
+import io
+import tempfile
+import wave
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from time import perf_counter
+try:
+    import fcntl
+except ImportError:  # ويندوز: لا يوجد قفل بين العمليات
+    fcntl = None
 
 # --- إعدادات المنطقة الزمنية ---
 HOURS_DIFF = 3 
@@ -21,13 +41,71 @@ CHAT_FILE = 'chat_history.csv'
 ACTIVITY_FILE = 'user_activity.csv'
 FONT_FILE = 'Amiri-Regular.ttf'
 
-# رابط صوت الجرس
-NOTIFICATION_SOUND_URL = "https://upload.wikimedia.org/wikipedia/commons/0/05/Beep-09.ogg"
+LOG_COLUMNS = ["الاسم", "نوع الحركة", "التاريخ", "الوقت"]
+CHAT_COLUMNS = ["sender", "receiver", "message", "date", "time", "read"]
+# كل ملفات البيانات وأعمدتها (للترحيل بين محركات التخزين)
+DATA_FILES = {
+    LOG_FILE: LOG_COLUMNS,
+    USERS_FILE: ["username", "password"],
+    SETTINGS_FILE: ["timeout", "manual_alert_time", "manual_alert_target"],
+    CHAT_FILE: CHAT_COLUMNS,
+    ACTIVITY_FILE: ["username", "last_seen"],
+}
 
-st.set_page_config(page_title="نظام الحضور الذكي", layout="centered")
+# سجل الحضور في محرك csv مقسّم حسب الشهر داخل هذا المجلد:
+# YYYY-MM.csv للإضافات، و YYYY-MM.parquet للأشهر المغلقة بعد ضغطها (يتطلب pyarrow)
+LOG_PARTITION_DIR = os.path.splitext(LOG_FILE)[0]
+UNDATED_PARTITION = "0000-00"
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+XLSX_AVAILABLE = importlib.util.find_spec("openpyxl") is not None
+
+# وضع تعدد العمليات (عدة خوادم على نفس مجلد البيانات): أرقام التغيير في ملف مشترك بدل ذاكرة كل عملية
+MULTI_PROCESS = os.environ.get("ATTENDANCE_MULTIPROCESS", "0") == "1"
+GENERATION_FILE = os.environ.get("ATTENDANCE_GENERATION_FILE", "generation.json")
+# بدون fcntl لا يوجد قفل بين العمليات، فتعدد العمليات يفسد الملفات بصمت: نرفض التشغيل بدل ذلك
+if MULTI_PROCESS and fcntl is None:
+    raise RuntimeError("ATTENDANCE_MULTIPROCESS=1 يتطلب fcntl لقفل الملفات بين العمليات، وهو غير متوفر على هذا النظام")
+
+# --- محرك التخزين: csv (الافتراضي) أو sqlite ---
+STORAGE_BACKEND = os.environ.get("ATTENDANCE_STORAGE", "csv")
+SQLITE_FILE = os.environ.get("ATTENDANCE_DB", "attendance.db")
+# عدد الرسائل المعروضة في كل صفحة من المحادثة
+CHAT_PAGE_SIZE = 30
+# عدد صفوف السجل في كل صفحة من عارض السجل
+LOG_PAGE_SIZE = 50
+
+# أقصى عدد ملفات محفوظة في ذاكرة القراءة المشتركة (كل شهر من السجل ملف مستقل)
+READ_CACHE_MAX_ENTRIES = 64
+# كل كم ثانية تتحدث الأجزاء الحية (الحالة، الدردشة، التنبيهات) دون إعادة تشغيل الصفحة كاملة
+LIVE_REFRESH_SECONDS = 3
+# كل كم ثانية يُحفظ جدول التواجد (last_seen) على القرص
+PRESENCE_FLUSH_SECONDS = 10
+# كل كم ثانية يفحص خيط الخلفية جلسات العمل المنزلي الخاملة (0 = إيقاف)
+INACTIVITY_SWEEP_SECONDS = int(os.environ.get("ATTENDANCE_SWEEP_SECONDS", "30"))
+
+# ذاكرة النصوص العربية المُشكَّلة للتقارير، وعدد التقارير الجاهزة المحفوظة
+PDF_SHAPE_CACHE_SIZE = 50000
+PDF_RESULTS_MAX = 8
+# ملفات التصدير الجاهزة على القرص (تُحذف الأقدم بعد EXPORT_FILES_MAX ملف)
+EXPORT_DIR = 'exports'
+EXPORT_FILES_MAX = 20
+
+# صوت الجرس محلي (يُنشأ تلقائياً إن لم يوجد) بدل جلبه من الإنترنت عند كل عميل
+NOTIFICATION_SOUND_FILE = 'notification.wav'
+
+# --- ذاكرة الأصوات: مجلد على القرص + نسخ base64 في الذاكرة، وكلاهما محدود الحجم ---
+AUDIO_CACHE_DIR = 'audio_cache'
+AUDIO_CACHE_MAX_BYTES = 50 * 1024 * 1024
+AUDIO_MEMORY_MAX_BYTES = 10 * 1024 * 1024
+# مزود تحويل النص لكلام: gtts (الافتراضي) أو offline (نغمة محلية بدون إنترنت، للاختبارات)
+TTS_PROVIDER = os.environ.get("ATTENDANCE_TTS", "gtts")
 
-# تحديث كل 3 ثواني
-count = st_autorefresh(interval=3000, limit=None, key="fizzbuzzcounter")
+# القياس (اختياري): ATTENDANCE_PROFILE=1 أو من تبويب الأداء، وآخر PROFILE_BUFFER_SIZE قياس فقط في الذاكرة
+PROFILING_ENABLED = os.environ.get("ATTENDANCE_PROFILE", "0") == "1"
+PROFILE_BUFFER_SIZE = 20000
+PROFILE_EXPORT_FILE = 'profile_samples.csv'
+
+st.set_page_config(page_title="نظام الحضور الذكي", layout="centered")
 
 # --- CSS ---
 st.markdown("""
@@ -52,40 +130,789 @@ div.stButton > button:hover {
 </style>
 """, unsafe_allow_html=True)
 
-# --- دوال البيانات ---
-def load_data(file_path, columns):
-    if os.path.exists(file_path):
+# --- قفل الملفات (بين العمليات) ---
+# shared للقراءة (عدة قراء معاً)، وبدونه حصري للكتابة. القفل يعاد دخوله في نفس الخيط
+# (مثلاً قراءة-تعديل-كتابة ثم save_data) بدل أن ينتظر الخيط نفسه
+# الأقفال المحجوزة لكل خيط في مورد مشترك: الصفحة تُنفَّذ من جديد مع كل إعادة تشغيل، ومحرك التخزين محفوظ من تشغيل سابق
+@st.cache_resource
+def _get_held_locks():
+    return threading.local()
+
+@contextmanager
+def file_lock(file_path, shared=False):
+    held = _get_held_locks().__dict__.setdefault("paths", set())
+    if file_path in held:
+        yield
+        return
+    with open(file_path + ".lock", "a") as lock_f:
+        if fcntl: fcntl.flock(lock_f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        held.add(file_path)
+        try: yield
+        finally:
+            held.discard(file_path)
+            if fcntl: fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
+
+# --- كتابة ذرية: ملف مؤقت ثم استبدال، فالقارئ يرى الملف القديم أو الجديد كاملاً فقط ---
+@contextmanager
+def atomic_path(path):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+
+def file_signature(path):
+    # الاستبدال الذري يغيّر رقم الـ inode حتى لو تساوى الوقت والحجم
+    try:
+        info = os.stat(path)
+        return (info.st_ino, info.st_mtime_ns, info.st_size)
+    except OSError:
+        return None
+
+# --- محركات التخزين ---
+# كل محرك يوفر: signature / load / save / append / update
+# signature تتغير مع كل كتابة وتساوي None إذا لم يكن الملف (الجدول) موجوداً
+# أخطاء الكتابة لا تُبلع داخل المحرك: تصل للمستدعي الذي يعرض رسالة خطأ بدل رسالة النجاح
+STORAGE_ERRORS = (OSError, sqlite3.Error)
+class CsvStorage:
+    name = "csv"
+
+    def __init__(self):
+        self._compacted_month = None
+        # أقسام السجل المقروءة {المسار: (التوقيع، الجدول)}: المحرك يقرأ ملفاته بنفسه لا عبر محرك التطبيق الحالي
+        self._parts_lock, self._parts = threading.Lock(), OrderedDict()
+        self.legacy_error = None
+        self._split_legacy_log()
+
+    def signature(self, file_path):
+        if file_path == LOG_FILE:
+            sigs = tuple((p,) + sig for _, paths in self._partitions() for p in paths if (sig := file_signature(p)))
+            return sigs or None
+        return file_signature(file_path)
+
+    def grew_by(self, old_sig, new_sig, written):
+        # هل التغيير بين التوقيعين هو الإلحاق الذي كتبناه فقط؟ (نفس الملف، والحجم زاد بما كتبناه)
+        return bool(written and old_sig and new_sig and new_sig[0] == old_sig[0] and new_sig[2] == old_sig[2] + written)
+
+    def load(self, file_path, columns):
+        if file_path == LOG_FILE:
+            frames = [self._read_partition(p) for _, paths in self._partitions() for p in paths]
+            return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
         try:
-            return pd.read_csv(file_path, dtype=str)
+            if file_path.endswith(".parquet"): return pd.read_parquet(file_path)
+            # قفل مشترك: لا نقرأ سطراً نصف مكتوب أثناء إلحاق من خيط أو عملية أخرى
+            with file_lock(file_path, shared=True): return pd.read_csv(file_path, dtype=str)
         except:
             return pd.DataFrame(columns=columns)
-    return pd.DataFrame(columns=columns)
 
+    def save(self, df, file_path):
+        with file_lock(file_path): return self._write_frame(df, file_path)
+
+    # كتابة ذرية (الأخطاء تصل للمستدعي بدل أن تضيع الكتابة بصمت)، يعيد عدد البايتات المكتوبة
+    def _write_frame(self, df, file_path):
+        if file_path != LOG_FILE:
+            with atomic_path(file_path) as tmp: df.to_csv(tmp, index=False)
+            return os.path.getsize(file_path)
+        # إعادة كتابة السجل كاملاً: ملف csv لكل شهر (يُضغط لاحقاً)، ثم حذف ملفات الأشهر القديمة الأخرى
+        os.makedirs(LOG_PARTITION_DIR, exist_ok=True)
+        old = [p for _, paths in self._partitions() for p in paths]
+        written, new = 0, set()
+        for month, part in df.groupby(self._month_keys(df["التاريخ"]), sort=False):
+            part_path = os.path.join(LOG_PARTITION_DIR, f"{month}.csv")
+            with file_lock(part_path), atomic_path(part_path) as tmp: part.to_csv(tmp, index=False)
+            written += os.path.getsize(part_path); new.add(part_path)
+        for p in old:
+            if p not in new: os.remove(p)
+        return written
+
+    # إلحاق صفوف بنهاية الملف (بدون إعادة كتابة السجل كاملاً)، يعيد عدد البايتات المكتوبة
+    def append(self, rows, file_path, columns):
+        df = pd.DataFrame(rows, columns=columns)
+        if file_path != LOG_FILE: return self._append_file(df, file_path)
+        # حركات السجل تذهب لملف شهرها
+        self._maybe_compact()
+        os.makedirs(LOG_PARTITION_DIR, exist_ok=True)
+        return sum(self._append_file(part, os.path.join(LOG_PARTITION_DIR, f"{month}.csv"))
+                   for month, part in df.groupby(self._month_keys(df["التاريخ"]), sort=False))
+
+    def _append_file(self, df, file_path):
+        with file_lock(file_path):
+            size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+            payload = df.to_csv(index=False, header=(size == 0)).encode('utf-8')
+            fd = os.open(file_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                # إذا لم ينتهِ الملف بسطر جديد نضيفه حتى لا يلتصق الصف بالسابق
+                if size and os.lseek(fd, size - 1, os.SEEK_SET) >= 0 and os.read(fd, 1) not in (b"\n", b"\r"): payload = b"\n" + payload
+                written = len(payload)
+                while payload:
+                    payload = payload[os.write(fd, payload):]
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return written
+
+    def appended_since(self, file_path, old_sig, new_sig, columns):
+        # الصفوف المُلحقة بين التوقيعين (ذيل كل ملف كبر، وملفات csv الجديدة كاملة)، أو None إذا استُبدل ملف أو حُذف أو صغر
+        if not new_sig or file_path != LOG_FILE: return None
+        old = {p: rest for p, *rest in old_sig or ()}
+        if any(p not in {q for q, *_ in new_sig} for p in old): return None
+        frames = []
+        for p, ino, _, size in new_sig:
+            start = 0
+            if p in old:
+                if old[p][0] != ino or size < old[p][2]: return None
+                start = old[p][2]
+            elif not p.endswith(".csv"): return None
+            if size == start: continue
+            with open(p, "rb") as f:
+                f.seek(start)
+                chunk = f.read(size - start)
+            # توقيع أُخذ أثناء إلحاق لم ينتهِ: لا نعتمد على ذيل ناقص
+            if not chunk.endswith(b"\n"): return None
+            frames.append(pd.read_csv(io.BytesIO(chunk), header=0 if start == 0 else None, names=None if start == 0 else columns, dtype=str))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+    # تعديل الصفوف المطابقة لـ where (قراءة-تعديل-كتابة تحت القفل)، يعيد عدد الصفوف المعدلة
+    def update(self, file_path, columns, where, values):
+        with file_lock(file_path):
+            df = self.load(file_path, columns)
+            if df.empty: return 0
+            mask = pd.Series(True, index=df.index)
+            for col, val in where.items(): mask &= df[col] == val
+            if not mask.any(): return 0
+            for col, val in values.items(): df.loc[mask, col] = val
+            self._write_frame(df, file_path)
+            return int(mask.sum())
+
+    # --- أقسام السجل الشهرية ---
+    @staticmethod
+    def _month_keys(dates):
+        dates = dates.fillna("").astype(str)
+        return dates.str[:7].where(dates.str.match(r"^\d{4}-\d{2}"), UNDATED_PARTITION)
+
+    def _partitions(self):
+        # [(الشهر، [ملفاته])] مرتبة زمنياً، وملف parquet قبل إضافات csv داخل الشهر
+        try:
+            names = os.listdir(LOG_PARTITION_DIR)
+        except OSError:
+            return []
+        months = {}
+        for n in names:
+            month, ext = os.path.splitext(n)
+            if ext in (".csv", ".parquet") and not n.startswith("."):
+                months.setdefault(month, []).append(os.path.join(LOG_PARTITION_DIR, n))
+        return [(m, sorted(paths, key=lambda p: not p.endswith(".parquet"))) for m, paths in sorted(months.items())]
+
+    def _read_partition(self, path):
+        sig = file_signature(path)
+        with self._parts_lock:
+            hit = self._parts.get(path)
+            if hit is not None and hit[0] == sig:
+                self._parts.move_to_end(path)
+                return hit[1]
+        df = self.load(path, LOG_COLUMNS)
+        with self._parts_lock:
+            self._parts[path] = (sig, df)
+            self._parts.move_to_end(path)
+            while len(self._parts) > READ_CACHE_MAX_ENTRIES: self._parts.popitem(last=False)
+        return df
+
+    def _split_legacy_log(self):
+        # ترحيل لمرة واحدة: attendance_log.csv القديم يُقسّم إلى أشهر ويُحفظ الأصل باسم .bak
+        # الملف الفارغ سجل فارغ، والملف التالف يبقى كما هو ويظهر الخطأ في صفحة الأدمن بدل أن يتوقف التطبيق
+        if not os.path.isfile(LOG_FILE) or os.path.isdir(LOG_PARTITION_DIR): return
+        with file_lock(LOG_FILE):
+            if os.path.isdir(LOG_PARTITION_DIR) or not os.path.isfile(LOG_FILE): return
+            try:
+                df = pd.read_csv(LOG_FILE, dtype=str)
+            except pd.errors.EmptyDataError:
+                df = pd.DataFrame(columns=LOG_COLUMNS)
+            except (pd.errors.ParserError, UnicodeDecodeError) as e:
+                self.legacy_error = f"{LOG_FILE}: {e}"
+                return
+            if "التاريخ" not in df.columns:
+                self.legacy_error = f"{LOG_FILE}: عمود التاريخ غير موجود"
+                return
+            tmp_dir = LOG_PARTITION_DIR + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True); os.makedirs(tmp_dir)
+            for month, part in df.groupby(self._month_keys(df["التاريخ"]), sort=False):
+                part.to_csv(os.path.join(tmp_dir, f"{month}.csv"), index=False)
+            os.replace(tmp_dir, LOG_PARTITION_DIR)
+            os.replace(LOG_FILE, LOG_FILE + ".bak")
+
+    def _maybe_compact(self):
+        # مرة في الشهر لكل عملية: الأشهر المغلقة تُدمج في ملف parquet واحد
+        current = get_local_time().strftime("%Y-%m")
+        if self._compacted_month == current or not PARQUET_AVAILABLE: return
+        self._compacted_month = current
+        for month, paths in self._partitions():
+            csv_path = os.path.join(LOG_PARTITION_DIR, f"{month}.csv")
+            if month >= current or month == UNDATED_PARTITION or csv_path not in paths: continue
+            parquet_path = os.path.join(LOG_PARTITION_DIR, f"{month}.parquet")
+            try:
+                with file_lock(csv_path):
+                    # عملية أخرى ربما ضغطت هذا الشهر قبلنا
+                    if not os.path.exists(csv_path): continue
+                    df = pd.concat([self.load(p, LOG_COLUMNS) for p in paths], ignore_index=True)
+                    with atomic_path(parquet_path) as tmp: df.astype(object).to_parquet(tmp, index=False)
+                    os.remove(csv_path)
+            except (OSError, ValueError, ImportError):
+                pass
+
+    # --- استعلام السجل: قراءة الأشهر المطلوبة فقط ---
+    def _partitions_in(self, start=None, end=None):
+        for month, paths in self._partitions():
+            if month == UNDATED_PARTITION and (start or end): continue
+            if (start and month < start[:7]) or (end and month > end[:7]): continue
+            yield month, paths
+
+    def query_log(self, name=None, start=None, end=None, actions=None):
+        frames = [self._read_partition(p) for _, paths in self._partitions_in(start, end) for p in paths]
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=LOG_COLUMNS)
+        return _filter_log(df, name, start, end, actions)
+
+    def query_log_page(self, name=None, start=None, end=None, actions=None, offset=0, limit=None):
+        # الأحدث أولاً حسب (التاريخ، الوقت) ثم الأحدث إدخالاً، والحركات بلا تاريخ صالح أخيراً (قسمها 0000-00)
+        # الأشهر مرتبة أصلاً، فمن الأشهر الأحدث نرتب ونقتطع صفوف الصفحة فقط، وبقية الأشهر تُعد فقط
+        total, frames = 0, []
+        for _, paths in reversed(list(self._partitions_in(start, end))):
+            part = _filter_log(pd.concat([self._read_partition(p) for p in paths], ignore_index=True), name, start, end, actions)
+            lo, hi = max(offset - total, 0), len(part) if limit is None else offset + limit - total
+            if lo < len(part) and hi > 0:
+                part = part.iloc[::-1].sort_values(["التاريخ", "الوقت"], ascending=False, kind="stable", na_position="last")
+                frames.append(part.iloc[lo:hi])
+            total += len(part)
+        page = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=LOG_COLUMNS)
+        return page, total
+
+class SqliteStorage:
+    name = "sqlite"
+    # الفهارس: السجل حسب (الاسم، التاريخ) والدردشة حسب (المرسل، المستقبل)
+    INDEXES = {
+        os.path.splitext(LOG_FILE)[0]: [["الاسم", "التاريخ"]],
+        os.path.splitext(CHAT_FILE)[0]: [["sender", "receiver"]],
+    }
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS _versions (tbl TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    # اتصال لكل خيط (sqlite3 لا يسمح بمشاركة الاتصال بين الخيوط)
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _table(file_path):
+        return os.path.splitext(os.path.basename(file_path))[0]
+
+    @staticmethod
+    def _q(name):
+        return '"' + str(name).replace('"', '""') + '"'
+
+    @staticmethod
+    def _records(df):
+        return [[None if pd.isna(v) else str(v) for v in row] for row in df.itertuples(index=False, name=None)]
+
+    # كل كتابة في معاملة واحدة تزيد رقم نسخة الجدول، ومعه: عدد الكتابات غير الإلحاق (tbl#rewrite) وآخر rowid (tbl#rows)
+    # والتوقيع هو الثلاثة معاً، فيُعرف منه هل ما تغيّر إلحاق فقط وأي صفوف أُلحقت
+    @contextmanager
+    def _write(self, tbl, rewrite=True):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            upsert = "INSERT INTO _versions (tbl, version) VALUES (?, ?) ON CONFLICT(tbl) DO UPDATE SET version = {}"
+            conn.execute(upsert.format("version + 1"), (tbl, 1))
+            if rewrite: conn.execute(upsert.format("version + 1"), (tbl + "#rewrite", 1))
+            last = conn.execute(f"SELECT MAX(rowid) FROM {self._q(tbl)}").fetchone()[0] or 0
+            conn.execute(upsert.format("excluded.version"), (tbl + "#rows", last))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _ensure_table(self, conn, tbl, columns):
+        q = self._q
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {q(tbl)} ({', '.join(q(c) + ' TEXT' for c in columns)})")
+        for i, cols in enumerate(self.INDEXES.get(tbl, [])):
+            if all(c in columns for c in cols):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {q(f'idx_{tbl}_{i}')} ON {q(tbl)} ({', '.join(map(q, cols))})")
+
+    def _insert(self, conn, tbl, df):
+        q = self._q
+        sql = f"INSERT INTO {q(tbl)} ({', '.join(map(q, df.columns))}) VALUES ({', '.join('?' * len(df.columns))})"
+        conn.executemany(sql, self._records(df))
+
+    def signature(self, file_path):
+        # استعلام واحد حتى تكون الأرقام الثلاثة من نفس اللحظة
+        tbl = self._table(file_path)
+        row = self._conn().execute("SELECT (SELECT version FROM _versions WHERE tbl = ?), (SELECT version FROM _versions WHERE tbl = ?), "
+                                   "(SELECT version FROM _versions WHERE tbl = ?)", (tbl, tbl + "#rewrite", tbl + "#rows")).fetchone()
+        return row if row[0] is not None else None
+
+    def grew_by(self, old_sig, new_sig, written):
+        return bool(written and old_sig and new_sig and new_sig[0] == old_sig[0] + 1)
+
+    def appended_since(self, file_path, old_sig, new_sig, columns):
+        # الصفوف المُلحقة بين التوقيعين بترتيبها، أو None إذا حدثت كتابة أخرى (حفظ كامل أو تعديل)
+        # الجدول غير موجود في التوقيع القديم = لا صفوف قبله
+        old_sig = old_sig or (0, None, 0)
+        if not new_sig or old_sig[1] != new_sig[1] or old_sig[2] is None or new_sig[2] is None: return None
+        return pd.read_sql_query(f"SELECT {', '.join(map(self._q, columns))} FROM {self._q(self._table(file_path))} WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+                                 self._conn(), params=[old_sig[2], new_sig[2]])
+
+    def load(self, file_path, columns):
+        try:
+            return pd.read_sql_query(f"SELECT * FROM {self._q(self._table(file_path))} ORDER BY rowid", self._conn())
+        except Exception:
+            return pd.DataFrame(columns=columns)
+
+    def save(self, df, file_path):
+        tbl = self._table(file_path)
+        with self._write(tbl) as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {self._q(tbl)}")
+            self._ensure_table(conn, tbl, list(df.columns))
+            self._insert(conn, tbl, df)
+
+    def append(self, rows, file_path, columns):
+        df = pd.DataFrame(rows, columns=columns)
+        tbl = self._table(file_path)
+        with self._write(tbl, rewrite=False) as conn:
+            self._ensure_table(conn, tbl, columns)
+            self._insert(conn, tbl, df)
+        return len(df)
+
+    def update(self, file_path, columns, where, values):
+        q, tbl = self._q, self._table(file_path)
+        sql = f"UPDATE {q(tbl)} SET {', '.join(q(c) + ' = ?' for c in values)} WHERE {' AND '.join(q(c) + ' = ?' for c in where)}"
+        with self._write(tbl) as conn:
+            return conn.execute(sql, [str(v) for v in list(values.values()) + list(where.values())]).rowcount
+
+    def _log_where(self, name=None, start=None, end=None, actions=None):
+        q = self._q
+        conds, params = [], []
+        if name is not None: conds.append(f"{q('الاسم')} = ?"); params.append(name)
+        if start: conds.append(f"{q('التاريخ')} >= ?"); params.append(start)
+        if end: conds.append(f"{q('التاريخ')} <= ?"); params.append(end)
+        if actions: conds.append(f"{q('نوع الحركة')} IN ({', '.join('?' * len(actions))})"); params += list(actions)
+        return (f" WHERE {' AND '.join(conds)}" if conds else ""), params
+
+    def query_log(self, name=None, start=None, end=None, actions=None):
+        where, params = self._log_where(name, start, end, actions)
+        try:
+            return pd.read_sql_query(f"SELECT * FROM {self._q(self._table(LOG_FILE))}{where} ORDER BY rowid", self._conn(), params=params)
+        except Exception:
+            return pd.DataFrame(columns=LOG_COLUMNS)
+
+    # نفس ترتيب CsvStorage.query_log_page: الحركات بلا تاريخ صالح أخيراً، ثم (التاريخ، الوقت) تنازلياً، ثم الأحدث إدخالاً
+    LOG_NEWEST_FIRST = """("التاريخ" GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*') DESC, "التاريخ" DESC, "الوقت" DESC, rowid DESC"""
+
+    def query_log_page(self, name=None, start=None, end=None, actions=None, offset=0, limit=None):
+        where, params = self._log_where(name, start, end, actions)
+        tbl = self._q(self._table(LOG_FILE))
+        try:
+            total = self._conn().execute(f"SELECT COUNT(*) FROM {tbl}{where}", params).fetchone()[0]
+            page = pd.read_sql_query(f"SELECT * FROM {tbl}{where} ORDER BY {self.LOG_NEWEST_FIRST} LIMIT ? OFFSET ?", self._conn(),
+                                     params=params + [-1 if limit is None else limit, offset])
+            return page, total
+        except Exception:
+            return pd.DataFrame(columns=LOG_COLUMNS), 0
+
+def _filter_log(df, name=None, start=None, end=None, actions=None):
+    if df.empty: return df
+    mask = pd.Series(True, index=df.index)
+    if name is not None: mask &= df["الاسم"] == name
+    if start: mask &= df["التاريخ"] >= start
+    if end: mask &= df["التاريخ"] <= end
+    if actions: mask &= df["نوع الحركة"].isin(actions)
+    return df[mask].reset_index(drop=True)
+
+@st.cache_resource
+def get_storage(backend, db_path):
+    return SqliteStorage(db_path) if backend == "sqlite" else CsvStorage()
+
+def storage():
+    return get_storage(STORAGE_BACKEND, SQLITE_FILE)
+
+# --- ترحيل لمرة واحدة من ملفات CSV إلى SQLite ---
+def migrate_csv_to_sqlite(db_path=SQLITE_FILE):
+    source, target = CsvStorage(), SqliteStorage(db_path)
+    counts = {}
+    for file_path, columns in DATA_FILES.items():
+        if source.signature(file_path) is None: continue
+        df = source.load(file_path, columns)
+        target.save(df, file_path)
+        counts[file_path] = len(df)
+    return counts
+
+# --- القياس: زمن كل دالة ساخنة وكل إعادة تشغيل (لكل صفحة) في حلقة محدودة مشتركة بين الجلسات ---
+PROFILE_COLUMNS = ["ts", "page", "kind", "name", "ms", "rows", "bytes"]
+
+@st.cache_resource
+def _get_profiler():
+    # ctx: نطاق الخيط الحالي (الصفحة وإجماليات إعادة التشغيل، ومكدس الدوال المقيسة الجارية)
+    return {"lock": threading.Lock(), "enabled": PROFILING_ENABLED, "samples": deque(maxlen=PROFILE_BUFFER_SIZE), "ctx": threading.local()}
+
+# مراجع ثابتة حتى يكون فحص "هل القياس مفعل؟" شبه مجاني في الدوال الساخنة
+_profiler = _get_profiler()
+_profile_ctx = _profiler["ctx"]
+
+def _record_sample(page, kind, name, seconds, rows, written):
+    with _profiler["lock"]:
+        _profiler["samples"].append((get_local_time().strftime("%Y-%m-%d %H:%M:%S"), page, kind, name, round(seconds * 1000, 3), rows, written))
+
+def profile_note(rows=None, written=None):
+    # تضيف الدالة المقيسة الجارية عدد الصفوف المقروءة أو البايتات المكتوبة
+    stack = getattr(_profile_ctx, "stack", None)
+    if not stack: return
+    if rows is not None: stack[-1]["rows"] = (stack[-1]["rows"] or 0) + rows
+    if written is not None: stack[-1]["bytes"] += written
+
+@contextmanager
+def profile_rerun(page, name="script"):
+    if not _profiler["enabled"] or getattr(_profile_ctx, "run", None):
+        yield
+        return
+    run = _profile_ctx.run = {"page": page, "rows": 0, "bytes": 0}
+    t0 = perf_counter()
+    try: yield
+    finally:
+        _profile_ctx.run = None
+        _record_sample(page, "rerun", name, perf_counter() - t0, run["rows"], run["bytes"])
+
+def profiled(fn=None, page=None):
+    # page: للأجزاء الحية، فإعادة تشغيل الجزء وحده تُسجَّل كإعادة تشغيل لتلك الصفحة
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if not _profiler["enabled"]: return fn(*args, **kwargs)
+            if page and not getattr(_profile_ctx, "run", None):
+                with profile_rerun(page, fn.__name__): return inner(*args, **kwargs)
+            stack = _profile_ctx.__dict__.setdefault("stack", [])
+            notes = {"rows": None, "bytes": 0}
+            stack.append(notes)
+            t0 = perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+                if notes["rows"] is None and isinstance(result, pd.DataFrame): notes["rows"] = len(result)
+                return result
+            finally:
+                elapsed = perf_counter() - t0
+                stack.pop()
+                run = getattr(_profile_ctx, "run", None)
+                # إجماليات إعادة التشغيل من الدوال الخارجية فقط حتى لا تُحسب القراءة المتداخلة مرتين
+                if run and not stack: run["rows"] += notes["rows"] or 0; run["bytes"] += notes["bytes"]
+                _record_sample(run["page"] if run else "background", "call", fn.__name__, elapsed, notes["rows"], notes["bytes"])
+        return inner
+    return wrap(fn) if fn else wrap
+
+def profile_samples():
+    with _profiler["lock"]: samples = list(_profiler["samples"])
+    return pd.DataFrame(samples, columns=PROFILE_COLUMNS)
+
+def profile_summary(samples):
+    # p50/p95 لكل (صفحة، نوع، دالة)
+    if samples.empty: return pd.DataFrame()
+    g = samples.groupby(["kind", "page", "name"])
+    out = pd.DataFrame({"calls": g.size(), "p50 ms": g["ms"].quantile(0.5), "p95 ms": g["ms"].quantile(0.95),
+                        "max ms": g["ms"].max(), "rows": g["rows"].sum(), "bytes": g["bytes"].sum()})
+    return out.round(2).reset_index().sort_values(["kind", "p95 ms"], ascending=[False, False], ignore_index=True)
+
+# --- ذاكرة قراءة مشتركة بين كل الجلسات (تتجدد عند تغير الملف) ---
+@st.cache_resource
+def _get_read_cache():
+    return {"lock": threading.Lock(), "entries": OrderedDict(), "key_locks": {}}
+
+def invalidate_cache(file_path=None):
+    cache = _get_read_cache()
+    with cache["lock"]:
+        if file_path is None: cache["entries"].clear()
+        else: cache["entries"].pop(os.path.abspath(file_path), None)
+
+# --- دوال البيانات ---
+def _cache_signature(file_path):
+    sig = storage().signature(file_path)
+    # ملفات البيانات الرئيسية تتجدد أيضاً مع رقم قناتها (المشترك بين العمليات في وضع تعدد العمليات)
+    if sig is not None and file_path in FILE_CHANNELS: sig = (sig, get_version(FILE_CHANNELS[file_path]))
+    return sig
+
+def _cache_hit(cache, key, sig):
+    with cache["lock"]:
+        hit = cache["entries"].get(key)
+        if hit is not None and hit[0] == sig:
+            cache["entries"].move_to_end(key)
+            return hit[1].copy()
+    return None
+
+@profiled
+def load_data(file_path, columns):
+    key = os.path.abspath(file_path)
+    cache = _get_read_cache()
+    sig = _cache_signature(file_path)
+    if sig is None: return pd.DataFrame(columns=columns)
+    df = _cache_hit(cache, key, sig)
+    if df is not None: return df
+    with cache["lock"]:
+        key_lock = cache["key_locks"].setdefault(key, threading.Lock())
+    # قفل الملف (مشترك) قبل قفل المفتاح دائماً، كما في modify_data (قفل الملف الحصري ثم load_data)، وإلا تعارض الترتيبان
+    # وقفل المفتاح: عند تغيّر الملف تقرأه جلسة واحدة فقط والبقية تنتظر النتيجة
+    with file_lock(file_path, shared=True), key_lock:
+        sig = _cache_signature(file_path)
+        if sig is None: return pd.DataFrame(columns=columns)
+        df = _cache_hit(cache, key, sig)
+        if df is not None: return df
+        df = storage().load(file_path, columns)
+        with cache["lock"]:
+            cache["entries"][key] = (sig, df)
+            cache["entries"].move_to_end(key)
+            while len(cache["entries"]) > READ_CACHE_MAX_ENTRIES:
+                cache["entries"].popitem(last=False)
+    return df.copy()
+
+@profiled
 def save_data(df, file_path):
+    profile_note(written=storage().save(df, file_path))
+    invalidate_cache(file_path); bump_version(FILE_CHANNELS.get(file_path, file_path))
+
+def modify_data(file_path, columns, change):
+    # قراءة-تعديل-كتابة تحت قفل الملف حتى لا تضيع كتابة عملية أخرى بين القراءة والحفظ
+    with file_lock(file_path):
+        df = change(load_data(file_path, columns))
+        save_data(df, file_path)
+    return df
+
+@profiled
+def append_rows(rows, file_path, columns):
+    if file_path != LOG_FILE: return _append_rows(rows, file_path, columns)
+    # حركات السجل تُضاف لفهرس آخر حالة ولملخصات الساعات مباشرة إذا لم يكتب أحد غيرنا في السجل منذ آخر بناء
+    # قفل الملخصات أولاً ثم قفل الفهرس، ويُحرَّر قفل الفهرس قبل إصلاح الملخصات حتى لا ينتظر last_log_entry الإصلاح
+    idx, rollup = _get_last_state(), _get_rollups()
+    with rollup["lock"]:
+        with idx["lock"]:
+            stamp = log_stamp()
+            written = _append_rows(rows, file_path, columns)
+            ours = get_version("log") == stamp[0] + 1
+            if ours:
+                new_stamp = log_stamp()
+                if idx["stamp"] == stamp: _merge_last_state(idx["last"], rows); idx["stamp"] = new_stamp
+        if ours and rollup["stamp"] == stamp:
+            rollup["stamp"] = new_stamp
+            _repair_rollup_days(rollup, dict.fromkeys((r["الاسم"], r["التاريخ"]) for r in rows))
+    return written
+
+def _append_rows(rows, file_path, columns):
     try:
-        df.to_csv(file_path, index=False)
-    except OSError:
-        pass
+        written = storage().append(rows, file_path, columns)
+        # csv يعيد البايتات المكتوبة، وsqlite عدد الصفوف
+        if storage().name == "csv": profile_note(written=written)
+        return written
+    finally:
+        invalidate_cache(file_path); bump_version(FILE_CHANNELS.get(file_path, file_path))
+
+# --- استعلام السجل حسب (الموظف، فترة التاريخ) دون قراءة التاريخ كاملاً ---
+@profiled
+def query_logs(name=None, start=None, end=None, actions=None):
+    return storage().query_log(name, start, end, actions)
+
+@profiled
+def query_logs_page(name=None, start=None, end=None, actions=None, page=0, page_size=LOG_PAGE_SIZE):
+    # صفحة واحدة من السجل (الأحدث أولاً) + عدد كل الصفوف المطابقة
+    return storage().query_log_page(name, start, end, actions, page * page_size, page_size)
+
+def last_log_entries():
+    # نسخة من الفهرس كاملاً {الاسم: (الحركة، التاريخ، الوقت)}
+    idx = _get_last_state()
+    with idx["lock"]:
+        return dict(_fresh_last_state()["last"])
+
+@profiled
+def last_log_entry(name):
+    # آخر حركة للموظف {"نوع الحركة", "التاريخ", "الوقت"} أو None، من الفهرس دون قراءة السجل
+    idx = _get_last_state()
+    with idx["lock"]:
+        hit = _fresh_last_state()["last"].get(name)
+    return dict(zip(LOG_COLUMNS[1:], hit)) if hit else None
+
+@profiled
+def update_rows(file_path, columns, where, values):
+    try:
+        return storage().update(file_path, columns, where, values)
+    finally:
+        invalidate_cache(file_path); bump_version(FILE_CHANNELS.get(file_path, file_path))
+
+# --- عدادات التغيير: لكل قناة رقم يزيد مع كل كتابة، والجلسة تقارن الرقم بدل تحميل البيانات ---
+# القنوات: log / users / settings / alerts / chat:<user>
+FILE_CHANNELS = {LOG_FILE: "log", USERS_FILE: "users", SETTINGS_FILE: "settings", CHAT_FILE: "chat", ACTIVITY_FILE: "activity"}
+
+# في وضع تعدد العمليات الأرقام في GENERATION_FILE: كل عملية تزيدها تحت القفل، وتعيد قراءتها فقط عندما يتغير الملف
+@st.cache_resource
+def _get_change_feed():
+    return {"lock": threading.Lock(), "versions": {}, "file_sig": None}
+
+def _read_generation():
+    try:
+        with open(GENERATION_FILE, encoding="utf-8") as f: return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def bump_version(*channels):
+    feed = _get_change_feed()
+    with feed["lock"]:
+        if not MULTI_PROCESS:
+            for channel in channels: feed["versions"][channel] = feed["versions"].get(channel, 0) + 1
+            return
+        with file_lock(GENERATION_FILE):
+            versions = _read_generation()
+            for channel in channels: versions[channel] = versions.get(channel, 0) + 1
+            with atomic_path(GENERATION_FILE) as tmp:
+                with open(tmp, "w", encoding="utf-8") as f: json.dump(versions, f)
+            feed.update({"versions": versions, "file_sig": file_signature(GENERATION_FILE)})
+
+def get_version(channel):
+    feed = _get_change_feed()
+    if MULTI_PROCESS:
+        sig = file_signature(GENERATION_FILE)
+        if sig != feed["file_sig"]:
+            with feed["lock"]: feed.update({"versions": _read_generation(), "file_sig": sig})
+    return feed["versions"].get(channel, 0)
+
+def changed_since_seen(channel, key):
+    # True مرة واحدة لكل تغيير في القناة (لكل جلسة)، ويُسجَّل الرقم الذي رأته الجلسة
+    version = get_version(channel)
+    if st.session_state.get(key) == version: return False
+    st.session_state[key] = version
+    return True
+
+# --- آخر حالة لكل موظف: {الاسم: (الحركة، التاريخ، الوقت)} مشتركة بين الجلسات ---
+# الأحدث حسب (التاريخ، الوقت)، تُحدَّث مع كل إلحاق للسجل، وتُبنى من السجل كاملاً عند أول استخدام
+# أو عند أي كتابة أخرى للسجل (حفظ كامل، تعديل، تعديل الملفات يدوياً) لأنها تغيّر log_stamp
+@st.cache_resource
+def _get_last_state():
+    return {"lock": threading.Lock(), "stamp": None, "last": {}}
+
+def log_stamp():
+    # رقم قناة log (كتابات هذه العملية) + توقيع التخزين (أي تغيير للسجل من خارجها) + اسم المحرك (التوقيعات تختلف شكلاً بين المحركات)
+    return (get_version("log"), storage().signature(LOG_FILE), storage().name)
+
+def log_appended_since(stamp, new_stamp):
+    # صفوف السجل المُلحقة بين ختمين (مثلاً من عملية أخرى في وضع تعدد العمليات)، أو None إذا تغيّر السجل بغير الإلحاق
+    if stamp is None or stamp[2] != new_stamp[2]: return None
+    if stamp[1] == new_stamp[1]: return pd.DataFrame(columns=LOG_COLUMNS)
+    return storage().appended_since(LOG_FILE, stamp[1], new_stamp[1], LOG_COLUMNS)
+
+def _latest_by_user(df):
+    if df.empty: return {}
+    df = df.assign(_d=df["التاريخ"].fillna("").astype(str), _t=df["الوقت"].fillna("").astype(str))
+    df = df.sort_values(["_d", "_t"], kind="stable").drop_duplicates("الاسم", keep="last")
+    return {name: (action, d, t) for name, action, d, t in zip(df["الاسم"], df["نوع الحركة"], df["_d"], df["_t"])}
+
+def _merge_last_state(last, rows):
+    for name, (action, d, t) in _latest_by_user(pd.DataFrame(rows, columns=LOG_COLUMNS)).items():
+        if name not in last or (d, t) >= last[name][1:]: last[name] = (action, d, t)
+
+def _fresh_last_state():
+    # يُستدعى والقفل محجوز
+    idx = _get_last_state()
+    stamp = log_stamp()
+    if idx["stamp"] != stamp:
+        # إلحاق فقط (من عملية أخرى مثلاً): ندمج الصفوف الجديدة، وغير ذلك إعادة بناء من السجل كاملاً
+        rows = log_appended_since(idx["stamp"], stamp)
+        if rows is None: idx["last"] = _latest_by_user(load_data(LOG_FILE, LOG_COLUMNS))
+        else: _merge_last_state(idx["last"], rows)
+        idx["stamp"] = stamp
+    return idx
 
 # --- دالة التوقيت المحلي ---
 def get_local_time():
     return datetime.utcnow() + timedelta(hours=HOURS_DIFF)
 
+# --- جدول التواجد في الذاكرة (مشترك بين الجلسات ويُحفظ دورياً) ---
+def _presence_flush_loop(registry):
+    while not registry["stop"].wait(PRESENCE_FLUSH_SECONDS):
+        try: flush_presence(registry)
+        except STORAGE_ERRORS: pass
+
+@st.cache_resource
+def _get_presence_registry():
+    registry = {"lock": threading.Lock(), "last_seen": {}, "dirty": False, "stop": threading.Event()}
+    df = load_data(ACTIVITY_FILE, ["username", "last_seen"]).dropna()
+    if not df.empty: registry["last_seen"] = dict(zip(df['username'], df['last_seen'].astype(str)))
+    _get_change_feed()  # تهيئة قبل بدء خيط الحفظ
+    threading.Thread(target=_presence_flush_loop, args=(registry,), daemon=True, name="presence-flush").start()
+    return registry
+
+def flush_presence(registry=None):
+    registry = registry or _get_presence_registry()
+    with registry["lock"]:
+        dirty = registry["dirty"]; registry["dirty"] = False
+    if not dirty and not MULTI_PROCESS: return
+    with file_lock(ACTIVITY_FILE):
+        with registry["lock"]: snapshot = dict(registry["last_seen"])
+        if MULTI_PROCESS:
+            # كل عملية ترى موظفيها فقط: ندمج الملف (الأحدث لكل موظف) قبل الكتابة، ونأخذ ما سجلته العمليات الأخرى
+            df = load_data(ACTIVITY_FILE, ["username", "last_seen"]).dropna()
+            for user, seen in zip(df["username"], df["last_seen"].astype(str)):
+                if seen > snapshot.get(user, ""): snapshot[user] = seen
+            with registry["lock"]:
+                for user, seen in snapshot.items():
+                    if seen > registry["last_seen"].get(user, ""): registry["last_seen"][user] = seen
+        if not dirty: return
+        try: save_data(pd.DataFrame({"username": list(snapshot), "last_seen": list(snapshot.values())}), ACTIVITY_FILE)
+        except STORAGE_ERRORS:
+            # تبقى التغييرات معلّقة للمحاولة التالية
+            with registry["lock"]: registry["dirty"] = True
+            raise
+
+def get_presence_snapshot():
+    registry = _get_presence_registry()
+    with registry["lock"]:
+        return dict(registry["last_seen"])
+
 # --- دالة حفظ نشاط الموظف (تحديث النشاط) ---
 def save_user_activity(username):
-    df = load_data(ACTIVITY_FILE, ["username", "last_seen"])
+    registry = _get_presence_registry()
     now_str = get_local_time().strftime("%Y-%m-%d %H:%M:%S")
-    
-    # حذف السجل القديم للمستخدم (إن وجد) وإضافة الجديد
-    df = df[df['username'] != username]
-    new_row = pd.DataFrame([{"username": username, "last_seen": now_str}])
-    df = pd.concat([df, new_row], ignore_index=True)
-    
-    save_data(df, ACTIVITY_FILE)
+    with registry["lock"]:
+        registry["last_seen"][username] = now_str
+        registry["dirty"] = True
+
+# --- فهرس الدردشة (مشترك): رسائل كل محادثة + عدادات غير المقروء ---
+# رقم الرسالة = ترتيبها في الملف، والفهرس يُبنى من جديد فقط إذا تغيّر الملف من خارج هذه الدوال
+@st.cache_resource
+def _get_chat_index():
+    return {"lock": threading.Lock(), "sig": None, "rows": [], "pairs": {}, "unread": {}}
+
+def _pair_key(user1, user2):
+    return (user1, user2) if str(user1) <= str(user2) else (user2, user1)
+
+def _index_message(idx, pos, row):
+    idx["pairs"].setdefault(_pair_key(row["sender"], row["receiver"]), []).append(pos)
+    if row["read"] == "False":
+        key = (row["receiver"], row["sender"])
+        idx["unread"][key] = idx["unread"].get(key, 0) + 1
+
+def _fresh_chat_index():
+    # يُستدعى والقفل محجوز
+    idx = _get_chat_index()
+    sig = storage().signature(CHAT_FILE)
+    if idx["sig"] is None or sig != idx["sig"]:
+        rows = load_data(CHAT_FILE, CHAT_COLUMNS).to_dict('records')
+        idx.update({"sig": sig, "rows": rows, "pairs": {}, "unread": {}})
+        for pos, row in enumerate(rows): _index_message(idx, pos, row)
+    return idx
 
 # --- دوال الدردشة ---
+@profiled
 def send_message(sender, receiver, message):
-    df = load_data(CHAT_FILE, ["sender", "receiver", "message", "date", "time", "read"])
     now = get_local_time()
     new_msg = {
         "sender": sender,
@@ -95,23 +922,56 @@ def send_message(sender, receiver, message):
         "time": now.strftime("%H:%M:%S"),
         "read": "False"
     }
-    df = pd.concat([df, pd.DataFrame([new_msg])], ignore_index=True)
-    save_data(df, CHAT_FILE)
+    idx = _get_chat_index()
+    with idx["lock"]:
+        idx = _fresh_chat_index()
+        old_sig = idx["sig"]
+        written = append_rows([new_msg], CHAT_FILE, CHAT_COLUMNS)
+        new_sig = storage().signature(CHAT_FILE)
+        # إذا كان التغيير هو رسالتنا فقط نضيفها للفهرس مباشرة، وإلا يُعاد بناؤه عند القراءة التالية
+        if storage().grew_by(old_sig, new_sig, written):
+            idx["rows"].append(new_msg); _index_message(idx, len(idx["rows"]) - 1, new_msg); idx["sig"] = new_sig
+        else:
+            idx["sig"] = None
+    bump_version(f"chat:{sender}", f"chat:{receiver}")
 
-def get_chat_history(user1, user2):
-    df = load_data(CHAT_FILE, ["sender", "receiver", "message", "date", "time", "read"])
-    if df.empty: return pd.DataFrame()
-    mask = ((df['sender'] == user1) & (df['receiver'] == user2)) | \
-           ((df['sender'] == user2) & (df['receiver'] == user1))
-    return df[mask]
+@profiled
+def get_chat_history(user1, user2, last_n=None, since_id=None):
+    idx = _get_chat_index()
+    with idx["lock"]:
+        idx = _fresh_chat_index()
+        positions = idx["pairs"].get(_pair_key(user1, user2), [])
+        if since_id is not None:
+            positions = positions[bisect.bisect_right(positions, since_id):]
+        if last_n is not None:
+            positions = positions[-last_n:] if last_n > 0 else []
+        page = [idx["rows"][pos] for pos in positions]
+    if not page: return pd.DataFrame()
+    return pd.DataFrame(page, index=positions, columns=CHAT_COLUMNS)
+
+def get_chat_count(user1, user2):
+    idx = _get_chat_index()
+    with idx["lock"]:
+        return len(_fresh_chat_index()["pairs"].get(_pair_key(user1, user2), []))
+
+def get_unread_count(user_reader, sender_user):
+    idx = _get_chat_index()
+    with idx["lock"]:
+        return _fresh_chat_index()["unread"].get((user_reader, sender_user), 0)
 
 def mark_as_read(user_reader, sender_user):
-    df = load_data(CHAT_FILE, ["sender", "receiver", "message", "date", "time", "read"])
-    if not df.empty:
-        mask = (df['sender'] == sender_user) & (df['receiver'] == user_reader) & (df['read'] == "False")
-        if mask.any():
-            df.loc[mask, 'read'] = "True"
-            save_data(df, CHAT_FILE)
+    idx = _get_chat_index()
+    # قفل الملف: لا يكتب أحد في الدردشة بين تحديث الملف وتحديث الفهرس، فنحدّث الفهرس مكانه بدل إعادة بنائه
+    with idx["lock"], file_lock(CHAT_FILE):
+        idx = _fresh_chat_index()
+        if not idx["unread"].get((user_reader, sender_user), 0): return
+        update_rows(CHAT_FILE, CHAT_COLUMNS, {"sender": sender_user, "receiver": user_reader, "read": "False"}, {"read": "True"})
+        for pos in idx["pairs"].get(_pair_key(user_reader, sender_user), []):
+            row = idx["rows"][pos]
+            if row["sender"] == sender_user and row["receiver"] == user_reader: row["read"] = "True"
+        idx["unread"][(user_reader, sender_user)] = 0
+        idx["sig"] = storage().signature(CHAT_FILE)
+    bump_version(f"chat:{user_reader}", f"chat:{sender_user}")
 
 # --- دالة التجميل ---
 def style_data(df):
@@ -127,67 +987,174 @@ def style_data(df):
     return df_view
 
 # --- إعدادات الخمول والتنبيه اليدوي ---
-@st.cache_data
-def get_settings_cached(_dummy_trigger=None):
-    if os.path.exists(SETTINGS_FILE):
-        try:
-            df = pd.read_csv(SETTINGS_FILE)
-            if 'manual_alert_time' not in df.columns: df['manual_alert_time'] = '0'
-            if 'manual_alert_target' not in df.columns: df['manual_alert_target'] = 'all'
-            return df.iloc[0]
-        except: return pd.Series({'timeout': 5, 'manual_alert_time': '0', 'manual_alert_target': 'all'})
-    return pd.Series({'timeout': 5, 'manual_alert_time': '0', 'manual_alert_target': 'all'})
+# المفتاح رقم قناة settings: أي حفظ (من أي عملية في وضع تعدد العمليات) يجعل القراءة التالية جديدة بدل .clear() المحلي
+@st.cache_data(max_entries=4)
+def _settings_at(generation):
+    return read_settings()
+
+def get_settings_cached():
+    return _settings_at(get_version("settings"))
+
+# بدون st.cache_data حتى يمكن استدعاؤها من خيوط الخلفية
+def read_settings():
+    try:
+        df = load_data(SETTINGS_FILE, DATA_FILES[SETTINGS_FILE])
+        if 'manual_alert_time' not in df.columns: df['manual_alert_time'] = '0'
+        if 'manual_alert_target' not in df.columns: df['manual_alert_target'] = 'all'
+        return df.iloc[0]
+    except: return pd.Series({'timeout': 5, 'manual_alert_time': '0', 'manual_alert_target': 'all'})
 
 def update_settings(timeout=None, alert_time=None, alert_target=None):
-    current = get_settings_cached()
-    
-    new_timeout = timeout if timeout is not None else current.get('timeout', 5)
-    new_alert_time = alert_time if alert_time is not None else current.get('manual_alert_time', '0')
-    new_alert_target = alert_target if alert_target is not None else current.get('manual_alert_target', 'all')
-    
-    df = pd.DataFrame([{
-        'timeout': new_timeout, 
-        'manual_alert_time': new_alert_time,
-        'manual_alert_target': new_alert_target
-    }])
-    save_data(df, SETTINGS_FILE)
-    get_settings_cached.clear()
+    def change(_):
+        # القراءة داخل القفل: آخر إعدادات حفظتها أي عملية
+        current = read_settings()
+        new_timeout = timeout if timeout is not None else current.get('timeout', 5)
+        new_alert_time = alert_time if alert_time is not None else current.get('manual_alert_time', '0')
+        new_alert_target = alert_target if alert_target is not None else current.get('manual_alert_target', 'all')
+        return pd.DataFrame([{
+            'timeout': new_timeout, 
+            'manual_alert_time': new_alert_time,
+            'manual_alert_target': new_alert_target
+        }])
+    modify_data(SETTINGS_FILE, DATA_FILES[SETTINGS_FILE], change)
 
 def trigger_manual_alert(target_user):
     now_str = datetime.now().strftime("%Y%m%d%H%M%S")
     update_settings(alert_time=now_str, alert_target=target_user)
+    bump_version("alerts")
+
+# --- مزودات تحويل النص لكلام: كل مزود يعيد (bytes, mime) ---
+def _gtts_synthesize(text, lang):
+    buf = io.BytesIO()
+    gTTS(text=text, lang=lang).write_to_fp(buf)
+    return buf.getvalue(), "audio/mp3"
+
+def _tone_wav(freq=880, seconds=0.3, rate=22050):
+    t = np.arange(int(rate * seconds)) / rate
+    samples = (np.sin(2 * np.pi * freq * t) * np.minimum(1, (seconds - t) * 20) * 12000).astype('<i2')
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1); w.setsampwidth(2); w.setframerate(rate); w.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+def _offline_synthesize(text, lang):
+    return _tone_wav(), "audio/wav"
+
+TTS_PROVIDERS = {"gtts": _gtts_synthesize, "offline": _offline_synthesize}
+
+@st.cache_resource
+def _get_audio_cache():
+    return {"lock": threading.Lock(), "entries": OrderedDict(), "bytes": 0, "key_locks": {},
+            "provider": TTS_PROVIDERS.get(TTS_PROVIDER, _gtts_synthesize)}
+
+def set_tts_provider(provider):
+    # provider(text, lang) -> (bytes, mime)
+    cache = _get_audio_cache()
+    with cache["lock"]:
+        cache["provider"] = provider; cache["entries"].clear(); cache["bytes"] = 0
+
+def _remember_audio(cache, key, value):
+    with cache["lock"]:
+        if key in cache["entries"]: return
+        cache["entries"][key] = value; cache["bytes"] += len(value[0])
+        while cache["bytes"] > AUDIO_MEMORY_MAX_BYTES and len(cache["entries"]) > 1:
+            cache["bytes"] -= len(cache["entries"].popitem(last=False)[1][0])
+
+def _trim_audio_dir():
+    infos = []
+    for name in os.listdir(AUDIO_CACHE_DIR):
+        if name.startswith("."): continue
+        path = os.path.join(AUDIO_CACHE_DIR, name)
+        try: info = os.stat(path)
+        except OSError: continue
+        infos.append((info.st_mtime, info.st_size, path))
+    infos.sort()
+    total = sum(size for _, size, _ in infos)
+    for _, size, f in infos:
+        if total <= AUDIO_CACHE_MAX_BYTES: break
+        try: os.remove(f); total -= size
+        except OSError: pass
+
+# الصوت لكل (نص، لغة) يُولَّد مرة واحدة، ثم يُقرأ من الذاكرة أو من القرص
+def get_tts_audio(text, lang='ar'):
+    cache = _get_audio_cache()
+    provider = cache["provider"]
+    key = hashlib.sha256(f"{getattr(provider, '__name__', provider)}|{lang}|{text}".encode()).hexdigest()
+    with cache["lock"]:
+        if key in cache["entries"]:
+            cache["entries"].move_to_end(key)
+            return cache["entries"][key]
+        key_lock = cache["key_locks"].setdefault(key, threading.Lock())
+    with key_lock:
+        with cache["lock"]:
+            if key in cache["entries"]: return cache["entries"][key]
+        os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
+        for mime, ext in (("audio/mp3", ".mp3"), ("audio/wav", ".wav")):
+            path = os.path.join(AUDIO_CACHE_DIR, key + ext)
+            if os.path.exists(path):
+                with open(path, "rb") as f: audio_bytes = f.read()
+                os.utime(path)
+                break
+        else:
+            audio_bytes, mime = provider(text, lang)
+            ext = ".wav" if mime == "audio/wav" else ".mp3"
+            # ملف مؤقت فريد ثم إعادة تسمية، حتى لا تتصادم الجلسات
+            fd, tmp = tempfile.mkstemp(dir=AUDIO_CACHE_DIR, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f: f.write(audio_bytes)
+            os.replace(tmp, os.path.join(AUDIO_CACHE_DIR, key + ext))
+            _trim_audio_dir()
+        value = (base64.b64encode(audio_bytes).decode(), mime)
+        _remember_audio(cache, key, value)
+    with cache["lock"]:
+        cache["key_locks"].pop(key, None)
+    return value
+
+def get_bell_audio():
+    cache = _get_audio_cache()
+    with cache["lock"]:
+        if "__bell__" in cache["entries"]: return cache["entries"]["__bell__"]
+    if not os.path.exists(NOTIFICATION_SOUND_FILE):
+        try:
+            with open(NOTIFICATION_SOUND_FILE, "wb") as f: f.write(_tone_wav())
+        except OSError: pass
+    try:
+        with open(NOTIFICATION_SOUND_FILE, "rb") as f: audio_bytes = f.read()
+    except OSError:
+        audio_bytes = _tone_wav()
+    value = (base64.b64encode(audio_bytes).decode(), "audio/wav")
+    _remember_audio(cache, "__bell__", value)
+    return value
+
+def audio_html(audio_base64, mime):
+    return f"""<audio autoplay><source src="data:{mime};base64,{audio_base64}" type="{mime}"></audio>"""
 
 def play_tts_alert(text):
     try:
-        tts = gTTS(text=text, lang='ar')
-        tts.save("alert_temp.mp3")
-        with open("alert_temp.mp3", "rb") as f:
-            audio_bytes = f.read()
-        audio_base64 = base64.b64encode(audio_bytes).decode()
-        audio_html = f"""<audio autoplay><source src="data:audio/mp3;base64,{audio_base64}" type="audio/mp3"></audio>"""
-        st.markdown(audio_html, unsafe_allow_html=True)
+        st.markdown(audio_html(*get_tts_audio(text, 'ar')), unsafe_allow_html=True)
     except: pass
 
 # --- التسجيل ---
+@profiled
 def record_action(user, action, auto=False, specific_time=None):
-    df = load_data(LOG_FILE, ["الاسم", "نوع الحركة", "التاريخ", "الوقت"])
     if specific_time: log_time = specific_time
     else: log_time = get_local_time()
     
-    if not df.empty:
-        last_entry = df[df["الاسم"] == user].tail(1)
-        if not last_entry.empty:
-            last_action = last_entry.iloc[0]["نوع الحركة"]
-            last_time_str = last_entry.iloc[0]["الوقت"]
-            if last_action == action and str(log_time.strftime("%H:%M")) in str(last_time_str):
-                 if not auto:
-                     st.session_state['msg_type'] = 'warning'
-                     st.session_state['msg_text'] = f"⚠️ مسجل مسبقاً: {action}"
-                 return 
+    last_entry = last_log_entry(user)
+    if last_entry is not None:
+        last_action = last_entry["نوع الحركة"]
+        last_time_str = last_entry["الوقت"]
+        if last_action == action and last_entry["التاريخ"] == log_time.strftime("%Y-%m-%d") and str(log_time.strftime("%H:%M")) in str(last_time_str):
+             if not auto:
+                 st.session_state['msg_type'] = 'warning'
+                 st.session_state['msg_text'] = f"⚠️ مسجل مسبقاً: {action}"
+             return True
 
     new_row = {"الاسم": user, "نوع الحركة": action, "التاريخ": log_time.strftime("%Y-%m-%d"), "الوقت": log_time.strftime("%H:%M:%S")}
-    df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-    save_data(df, LOG_FILE)
+    try: append_rows([new_row], LOG_FILE, ["الاسم", "نوع الحركة", "التاريخ", "الوقت"])
+    except STORAGE_ERRORS as e:
+        st.session_state['msg_type'] = 'error'
+        st.session_state['msg_text'] = f"❌ تعذر تسجيل {action}: {e}"
+        return False
     
     if auto:
         st.session_state['msg_type'] = 'warning'
@@ -195,131 +1162,568 @@ def record_action(user, action, auto=False, specific_time=None):
     else:
         st.session_state['msg_type'] = 'success'
         st.session_state['msg_text'] = f"✅ تم {action} ({log_time.strftime('%H:%M')})"
+    return True
 
-# --- الخروج التلقائي ---
-def check_inactivity():
-    if st.session_state.get('logged_in') and not st.session_state.get('is_admin'):
-        last_active = st.session_state.get('last_active_time')
-        current_status = st.session_state.get('current_status')
-        if last_active:
-            settings = get_settings_cached()
-            timeout = int(settings.get('timeout', 5)) * 60
-            if (get_local_time() - last_active).total_seconds() > timeout:
-                if current_status == "منزل":
-                    user = st.session_state['username']
-                    logout_time = last_active + timedelta(minutes=int(settings.get('timeout', 5)))
-                    record_action(user, "خروج منزلي", auto=True, specific_time=logout_time)
-                    st.session_state.update({'logged_in': False, 'username': '', 'current_status': None})
-                    st.rerun()
+# --- الخروج التلقائي: خيط واحد يفحص كل الموظفين بدل أن تفحص كل جلسة نفسها ---
+# من آخر حركته "دخول منزلي" ولم تصل نبضة من صفحته منذ أكثر من مدة الخمول (أُغلقت الصفحة) يُسجَّل له "خروج منزلي" عند آخر نشاط + المدة،
+# حتى لو أُغلق المتصفح، وكل الخروجات في كتابة واحدة
+def sweep_inactive_sessions(now=None):
+    now = now or get_local_time()
+    minutes = int(read_settings().get('timeout', 5))
+    presence = get_presence_snapshot()
+    rows = []
+    # قفل بين العمليات حتى لا يسجل خيطان (أو عمليتان) نفس الخروج
+    with file_lock(LOG_FILE + ".sweep"):
+        for user, (action, date_str, time_str) in last_log_entries().items():
+            if action != "دخول منزلي": continue
+            checkin = pd.to_datetime(f"{date_str} {time_str}", format="%Y-%m-%d %H:%M:%S", errors="coerce")
+            if pd.isna(checkin): continue
+            # آخر نشاط = الأحدث بين آخر نبضة وحركة الدخول نفسها، ونبضة من يوم آخر لا تخص هذه الجلسة
+            seen = pd.to_datetime(presence.get(user), format="%Y-%m-%d %H:%M:%S", errors="coerce")
+            seen = max(seen, checkin) if not pd.isna(seen) and seen.date() == checkin.date() else checkin
+            if now - seen <= timedelta(minutes=minutes): continue
+            # الساعات تُطابق داخل (الموظف، التاريخ)، فالخروج لا يتجاوز نهاية يوم الدخول
+            logout = min(seen + timedelta(minutes=minutes), checkin.normalize() + timedelta(days=1, seconds=-1))
+            rows.append({"الاسم": user, "نوع الحركة": "خروج منزلي", "التاريخ": logout.strftime("%Y-%m-%d"), "الوقت": logout.strftime("%H:%M:%S")})
+        if rows: append_rows(rows, LOG_FILE, LOG_COLUMNS)
+    return rows
+
+def _inactivity_sweep_loop(stop):
+    while not stop.wait(INACTIVITY_SWEEP_SECONDS):
+        try: sweep_inactive_sessions()
+        except Exception: pass
+
+@st.cache_resource
+def _get_inactivity_sweeper():
+    stop = threading.Event()
+    if INACTIVITY_SWEEP_SECONDS > 0:
+        # تهيئة الموارد المشتركة قبل بدء الخيط
+        _get_presence_registry(); _get_last_state(); _get_rollups(); _get_read_cache(); _get_change_feed()
+        threading.Thread(target=_inactivity_sweep_loop, args=(stop,), daemon=True, name="inactivity-sweep").start()
+    return stop
+
+def check_auto_logout(username):
+    # الجلسة لا تفحص الخمول بنفسها: فقط تنظر في فهرس آخر حالة هل سجّل الفاحص خروجها
+    if st.session_state.get('current_status') != "منزل": return
+    last = last_log_entry(username)
+    if last is not None and last["نوع الحركة"] == "خروج منزلي":
+        st.session_state.update({'logged_in': False, 'username': '', 'current_status': None,
+                                 'msg_type': 'warning', 'msg_text': f"⚠️ خروج تلقائي ({last['الوقت'][:5]})"})
+        st.rerun()
 
 def update_activity(): 
-    st.session_state['last_active_time'] = get_local_time()
-    # 🚀 تحسين: حفظ النشاط فوراً
+    # 🚀 تحسين: حفظ النشاط فوراً (كل إعادة رسم للصفحة = تفاعل من الموظف)
     if st.session_state.get('logged_in') and not st.session_state.get('is_admin'):
         username = st.session_state.get('username')
         if username:
             save_user_activity(username)
 
 # --- الحسابات ---
+# كل حركة: (المكان، هل هي دخول) بنفس ترتيب الفحص المستخدم سابقاً
+HOURS_MOVES = [("دخول مقر", "office", True), ("خروج مقر", "office", False), ("دخول منزلي", "home", True), ("خروج منزلي", "home", False)]
+
+def _pair_seconds(df_logs):
+    # كل خروج يُطابق مع الحركة السابقة له في نفس (الموظف، التاريخ، المكان): إن كانت دخولاً فهذه فترة عمل
+    # وهذا يطابق تماماً المنطق القديم (آخر دخول مفتوح يُغلق عند أول خروج، والخروج اليتيم يُتجاهل)
+    df = df_logs[["الاسم", "التاريخ", "نوع الحركة"]].copy()
+    df['DateTime'] = pd.to_datetime(df_logs['التاريخ'] + ' ' + df_logs['الوقت'], errors='coerce')
+    df = df.sort_values(by=['الاسم', 'DateTime'])
+    act = df['نوع الحركة'].astype(str)
+    conds = [act.str.contains(move, regex=False) for move, _, _ in HOURS_MOVES]
+    df['place'] = np.select(conds, [place for _, place, _ in HOURS_MOVES], default="")
+    df['is_in'] = np.select(conds, [is_in for _, _, is_in in HOURS_MOVES], default=False)
+    df = df[df['DateTime'].notna() & (df['place'] != "")]
+    if df.empty: return pd.DataFrame(columns=["office", "home"], index=pd.MultiIndex.from_tuples([], names=["الاسم", "التاريخ"]), dtype=float)
+    keys = [df['الاسم'], df['التاريخ'], df['place']]
+    prev_in = df['is_in'].groupby(keys).shift(1).eq(True)
+    dur = (df['DateTime'] - df['DateTime'].groupby(keys).shift(1)).dt.total_seconds()
+    df['sec'] = dur.where(~df['is_in'] & prev_in & (dur > 0), 0.0)
+    sec = df.groupby(['الاسم', 'التاريخ', 'place'])['sec'].sum().unstack('place', fill_value=0.0)
+    return sec.reindex(columns=["office", "home"], fill_value=0.0)
+
+def _format_hours(sec):
+    sec = sec[(sec["office"] + sec["home"]) > 0]
+    if sec.empty: return pd.DataFrame()
+    def fmt(s): return (s // 3600).astype(int).astype(str).str.zfill(2) + ":" + ((s % 3600) // 60).astype(int).astype(str).str.zfill(2)
+    out = sec.reset_index()
+    return pd.DataFrame({"الاسم": out["الاسم"], "التاريخ": out["التاريخ"], "ساعات المقر": fmt(out["office"]),
+                         "ساعات المنزل": fmt(out["home"]), "الإجمالي": fmt(out["office"] + out["home"])})
+
+@profiled
 def calculate_daily_hours(df_logs):
     if df_logs.empty: return pd.DataFrame()
-    df_logs['DateTime'] = pd.to_datetime(df_logs['التاريخ'] + ' ' + df_logs['الوقت'], errors='coerce')
-    df_logs = df_logs.sort_values(by=['الاسم', 'DateTime'])
-    summary_data = []
-    grouped = df_logs.groupby(['الاسم', 'التاريخ'])
-
-    for (name, date), group in grouped:
-        office_sec = 0; home_sec = 0
-        records = group.to_dict('records')
-        last_office = None; last_home = None
-        for rec in records:
-            act = rec['نوع الحركة']; ts = rec['DateTime']
-            if pd.isna(ts): continue
-            if "دخول مقر" in act: last_office = ts
-            elif "خروج مقر" in act and last_office:
-                d = (ts - last_office).total_seconds(); 
-                if d > 0: office_sec += d
-                last_office = None
-            elif "دخول منزلي" in act: last_home = ts
-            elif "خروج منزلي" in act and last_home:
-                d = (ts - last_home).total_seconds(); 
-                if d > 0: home_sec += d
-                last_home = None
-        def fmt(s): return f"{int(s//3600):02d}:{int((s%3600)//60):02d}"
-        total = office_sec + home_sec
-        if total > 0: summary_data.append({"الاسم": name, "التاريخ": date, "ساعات المقر": fmt(office_sec), "ساعات المنزل": fmt(home_sec), "الإجمالي": fmt(total)})
-    return pd.DataFrame(summary_data)
+    return _format_hours(_pair_seconds(df_logs))
+
+# --- ملخصات الساعات المحفوظة: ثواني المقر والمنزل لكل (موظف، يوم) و(موظف، أسبوع) و(موظف، شهر) ---
+# تُبنى من السجل كاملاً عند أول استخدام أو عند تغير log_stamp بغير الإلحاق، ومع كل إلحاق تُعاد مطابقة الأيام المتأثرة فقط
+ROLLUP_PERIODS = {"day": "التاريخ", "week": "الأسبوع", "month": "الشهر"}
+# أكثر من هذا العدد من (موظف، يوم) في إلحاق واحد: إعادة بناء كاملة بدل الإصلاح
+ROLLUP_REPAIR_MAX_DAYS = 2000
+
+@st.cache_resource
+def _get_rollups():
+    return {"lock": threading.Lock(), "stamp": None, "day": {}, "week": {}, "month": {}}
+
+def _period_keys(dates):
+    # الأسبوع يبدأ يوم الأحد
+    dates = pd.to_datetime(pd.Series(dates), format="%Y-%m-%d", errors="coerce")
+    week = (dates - pd.to_timedelta((dates.dt.weekday + 1) % 7, unit="D")).dt.strftime("%Y-%m-%d")
+    return week, dates.dt.strftime("%Y-%m")
+
+def _build_rollups(rollup, stamp):
+    rollup.update({"stamp": stamp, "day": {}, "week": {}, "month": {}})
+    logs = load_data(LOG_FILE, LOG_COLUMNS)
+    if logs.empty: return
+    sec = _pair_seconds(logs)
+    sec = sec[(sec["office"] + sec["home"]) > 0].reset_index()
+    if sec.empty: return
+    rollup["day"] = {(n, d): (o, h) for n, d, o, h in sec[["الاسم", "التاريخ", "office", "home"]].itertuples(index=False, name=None)}
+    for period, keys in zip(("week", "month"), _period_keys(sec["التاريخ"])):
+        rollup[period] = {k: (o, h) for k, o, h in sec.groupby([sec["الاسم"], keys])[["office", "home"]].sum().itertuples(name=None)}
+
+def _fresh_rollups():
+    # يُستدعى والقفل محجوز
+    rollup = _get_rollups()
+    stamp = log_stamp()
+    if rollup["stamp"] != stamp:
+        # إلحاق فقط: إصلاح الأيام المتأثرة، وغير ذلك إعادة بناء كاملة
+        rows = log_appended_since(rollup["stamp"], stamp)
+        if rows is None: _build_rollups(rollup, stamp)
+        else:
+            rollup["stamp"] = stamp
+            _repair_rollup_days(rollup, dict.fromkeys(zip(rows["الاسم"], rows["التاريخ"])))
+    return rollup
+
+def _repair_rollup_days(rollup, days):
+    # يُستدعى والقفل محجوز: إعادة مطابقة حركات كل (موظف، يوم) أُضيفت له حركات، بقراءة واحدة لكل شهر
+    # ومطابقة واحدة لكل الأيام، والدفعات الكبيرة يُعاد بناؤها كاملة لأن ذلك أسرع
+    if len(days) > ROLLUP_REPAIR_MAX_DAYS: return _build_rollups(rollup, rollup["stamp"])
+    days = pd.DataFrame(list(days), columns=["الاسم", "التاريخ"])
+    week, month = _period_keys(days["التاريخ"])
+    days = days.assign(week=week.values, month=month.values).dropna(subset=["month"])
+    if days.empty: return
+    frames = []
+    for _, group in days.groupby("month"):
+        names = group["الاسم"].unique()
+        logs = query_logs(name=names[0] if len(names) == 1 else None, start=group["التاريخ"].min(), end=group["التاريخ"].max())
+        frames.append(logs[pd.MultiIndex.from_frame(logs[["الاسم", "التاريخ"]]).isin(pd.MultiIndex.from_frame(group[["الاسم", "التاريخ"]]))])
+    logs = pd.concat(frames, ignore_index=True)
+    sec = _pair_seconds(logs) if not logs.empty else None
+    found = dict(zip(sec.index, sec[["office", "home"]].itertuples(index=False, name=None))) if sec is not None else {}
+    for name, date_str, week_key, month_key in days.itertuples(index=False, name=None):
+        office, home = found.get((name, date_str), (0.0, 0.0))
+        old = rollup["day"].pop((name, date_str), (0.0, 0.0))
+        if office or home: rollup["day"][(name, date_str)] = (office, home)
+        for period, key in (("week", week_key), ("month", month_key)):
+            o, h = rollup[period].get((name, key), (0.0, 0.0))
+            o, h = o + office - old[0], h + home - old[1]
+            if o or h: rollup[period][(name, key)] = (o, h)
+            else: rollup[period].pop((name, key), None)
+
+def rebuild_rollups():
+    rollup = _get_rollups()
+    with rollup["lock"]: _build_rollups(rollup, log_stamp())
+
+@profiled
+def hours_rollup(period="day", name=None, start=None, end=None):
+    # ساعات كل موظف لكل يوم/أسبوع/شهر (بداية الأسبوع، أو YYYY-MM للشهر) بنفس شكل calculate_daily_hours
+    rollup = _get_rollups()
+    with rollup["lock"]:
+        items = list(_fresh_rollups()[period].items())
+    sec = pd.DataFrame([(n, k, o, h) for (n, k), (o, h) in items], columns=["الاسم", "التاريخ", "office", "home"])
+    cut = 7 if period == "month" else None
+    if name is not None: sec = sec[sec["الاسم"] == name]
+    if start: sec = sec[sec["التاريخ"] >= start[:cut]]
+    if end: sec = sec[sec["التاريخ"] <= end[:cut]]
+    res = _format_hours(sec.set_index(["الاسم", "التاريخ"]).sort_index())
+    return res.rename(columns={"التاريخ": ROLLUP_PERIODS[period]})
+
+# --- حالة الموظفين (مباشر): تمريرة واحدة على حركات اليوم وجدول التواجد ---
+@profiled
+def compute_employee_status(employees, logs_df, presence, now):
+    status = pd.DataFrame({"username": pd.Series(employees, dtype=object)})
+    if status.empty: return pd.DataFrame(columns=["username", "icon", "text"])
+    # آخر حركة لكل موظف اليوم
+    today = logs_df[logs_df['التاريخ'] == now.strftime("%Y-%m-%d")] if not logs_df.empty else logs_df
+    last_action = today.drop_duplicates('الاسم', keep='last').set_index('الاسم')['نوع الحركة'] if not today.empty else pd.Series(dtype=object)
+    checked_in = status['username'].map(last_action).astype(str).str.contains("دخول", regex=False)
+    has_seen = status['username'].isin(list(presence))
+    last_seen = pd.to_datetime(status['username'].map(presence), format="%Y-%m-%d %H:%M:%S", errors='coerce')
+    diff = (now - last_seen).dt.total_seconds()
+    # 🟢 نشط خلال آخر 30 ثانية، 🟡 أقل من 5 دقائق
+    choices = [("🔴", "أوف لاين"), ("🟡", "غير معروف"), ("🟢", "نشط الآن"), ("🟡", "خامل")]
+    conds = [~checked_in | ~has_seen, last_seen.isna(), diff < 30, diff < 300]
+    status['icon'] = np.select(conds, [c[0] for c in choices], default="🟠")
+    status['text'] = np.select(conds, [c[1] for c in choices], default="خامل جداً")
+    return status
+
+# --- استيراد الحركات جماعياً: تحقق وإزالة تكرار على الدفعة كاملة ثم كتابة واحدة ---
+PUNCH_ACTIONS = [move for move, _, _ in HOURS_MOVES]
+IMPORT_ALIASES = {"name": "الاسم", "action": "نوع الحركة", "date": "التاريخ", "time": "الوقت"}
+IMPORT_DATE_FORMATS = ["%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%d/%m/%Y", "%Y/%m/%d"]
+IMPORT_TIME_FORMATS = ["%H:%M:%S", "%H:%M"]
+
+def read_punch_file(uploaded):
+    if uploaded.name.lower().endswith(".xlsx"): df = pd.read_excel(uploaded, dtype=str)
+    else: df = pd.read_csv(uploaded, dtype=str)
+    df = df.rename(columns=lambda c: IMPORT_ALIASES.get(str(c).strip().lower(), str(c).strip()))
+    missing = [c for c in LOG_COLUMNS if c not in df.columns]
+    if missing: raise ValueError("أعمدة ناقصة: " + "، ".join(missing))
+    return df[LOG_COLUMNS].reset_index(drop=True)
+
+def _parse_formats(values, formats, out_format):
+    values = values.fillna("").astype(str).str.strip()
+    parsed = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    for fmt in formats: parsed = parsed.fillna(pd.to_datetime(values, format=fmt, errors="coerce"))
+    return parsed.dt.strftime(out_format).where(parsed.notna())
+
+def prepare_punch_import(df):
+    # يعيد (الحركات الجديدة مرتبة زمنياً، الصفوف المرفوضة مع السبب)
+    clean = pd.DataFrame({"الاسم": df["الاسم"].fillna("").astype(str).str.strip(),
+                          "نوع الحركة": df["نوع الحركة"].fillna("").astype(str).str.strip(),
+                          "التاريخ": _parse_formats(df["التاريخ"], IMPORT_DATE_FORMATS, "%Y-%m-%d"),
+                          "الوقت": _parse_formats(df["الوقت"], IMPORT_TIME_FORMATS, "%H:%M:%S")})
+    users = load_data(USERS_FILE, ["username"])["username"].astype(str)
+    checks = [(~clean["الاسم"].isin(users), "موظف غير معروف"), (~clean["نوع الحركة"].isin(PUNCH_ACTIONS), "حركة غير معروفة"),
+              (clean["التاريخ"].isna(), "تاريخ غير صالح"), (clean["الوقت"].isna(), "وقت غير صالح")]
+    reason = pd.Series(np.select([c for c, _ in checks], [r for _, r in checks], default=""), index=clean.index)
+    reason = reason.mask((reason == "") & clean.duplicated(keep="first"), "مكرر في الملف")
+    ok = reason == ""
+    if ok.any():
+        # نقارن بحركات نفس الفترة فقط
+        existing = query_logs(start=clean.loc[ok, "التاريخ"].min(), end=clean.loc[ok, "التاريخ"].max())
+        seen = pd.MultiIndex.from_frame(clean).isin(pd.MultiIndex.from_frame(existing[LOG_COLUMNS].astype(str)))
+        reason = reason.mask(ok & seen, "موجود مسبقاً")
+    ok = reason == ""
+    new_rows = clean[ok].sort_values(["التاريخ", "الوقت"], kind="stable", ignore_index=True)
+    return new_rows, df[~ok].assign(السبب=reason[~ok])
+
+def import_punches(new_rows):
+    if new_rows.empty: return 0
+    append_rows(new_rows.to_dict('records'), LOG_FILE, LOG_COLUMNS)
+    return len(new_rows)
 
 # --- PDF ---
+def _shape_arabic(text):
+    return get_display(arabic_reshaper.reshape(text))
+
+# الأسماء وأنواع الحركة والعناوين تتكرر آلاف المرات، فنحفظ نتيجة التشكيل
+@st.cache_resource
+def _get_shaper():
+    return functools.lru_cache(maxsize=PDF_SHAPE_CACHE_SIZE)(_shape_arabic)
+
 def make_text_arabic(text):
     if not isinstance(text, str): text = str(text)
-    return get_display(arabic_reshaper.reshape(text))
+    return _get_shaper()(text)
 
-def generate_pdf(dataframe, title="تقرير"):
+# قالب PDF مع الخط محمّل مرة واحدة، وكل تقرير يأخذ نسخة منه
+@st.cache_resource
+def _get_pdf_template():
     if not os.path.exists(FONT_FILE): return None
+    pdf = FPDF()
+    pdf.add_font("Amiri", style="", fname=FONT_FILE)
+    return pdf
+
+@profiled
+def generate_pdf(dataframe, title="تقرير", progress=None):
+    template = _get_pdf_template()
+    if template is None: return None
     try:
-        pdf = FPDF()
+        pdf = copy.deepcopy(template)
         pdf.add_page()
-        pdf.add_font("Amiri", style="", fname=FONT_FILE); pdf.set_font("Amiri", size=12)
         pdf.set_font("Amiri", size=16); pdf.cell(0, 10, make_text_arabic(title), ln=True, align='C'); pdf.ln(5)
-        pdf.set_font("Amiri", size=10); headers = dataframe.columns.tolist()[::-1]
-        for h in headers: pdf.cell(35, 10, make_text_arabic(h), border=1, align='C')
-        pdf.ln(10)
-        for _, row in dataframe.iterrows():
-            for item in row.tolist()[::-1]: pdf.cell(35, 10, make_text_arabic(str(item)), border=1, align='C')
-            pdf.ln(10)
+        pdf.set_font("Amiri", size=10)
+        # الأعمدة من اليمين لليسار
+        shape = _get_shaper()
+        headers = [shape(str(h)) for h in dataframe.columns.tolist()[::-1]]
+        columns = [dataframe[c].astype(str).map(shape).tolist() for c in dataframe.columns[::-1]]
+        # عرض كل عمود حسب أطول نص فيه، ثم تصغير الكل إذا تجاوز عرض الصفحة
+        widths = [max([pdf.get_string_width(v) for v in set(col)] + [pdf.get_string_width(h)]) + 4 for h, col in zip(headers, columns)]
+        scale = min(1.0, pdf.epw / sum(widths)) if widths else 1.0
+        widths = [w * scale for w in widths]
+        def draw_header():
+            for h, w in zip(headers, widths): pdf.cell(w, 8, h, border=1, align='C')
+            pdf.ln(8)
+        draw_header()
+        total = len(dataframe)
+        for i, row in enumerate(zip(*columns)):
+            # صفحة جديدة مع تكرار رأس الجدول
+            if pdf.will_page_break(8):
+                pdf.add_page(); draw_header()
+            for item, w in zip(row, widths): pdf.cell(w, 8, item, border=1, align='C')
+            pdf.ln(8)
+            if progress and i % 200 == 0: progress(i / total)
+        if progress: progress(1.0)
         return bytes(pdf.output())
     except: return None
 
+# --- إنشاء التقارير في الخلفية مع حفظ النتيجة لنفس المدخلات ---
+@st.cache_resource
+def _get_report_worker():
+    return {"lock": threading.Lock(), "executor": ThreadPoolExecutor(max_workers=2, thread_name_prefix="report"), "jobs": OrderedDict()}
+
+def submit_pdf_report(dataframe, title="تقرير"):
+    key = hashlib.sha256(pd.util.hash_pandas_object(dataframe, index=False).values.tobytes()
+                         + "|".join(map(str, dataframe.columns)).encode() + title.encode()).hexdigest()
+    worker = _get_report_worker()
+    # تهيئة الموارد المشتركة هنا (وليس داخل خيط العمل)
+    _get_pdf_template(); _get_shaper()
+    with worker["lock"]:
+        if key in worker["jobs"]:
+            worker["jobs"].move_to_end(key)
+            return key
+        job = {"progress": 0.0}
+        job["future"] = worker["executor"].submit(generate_pdf, dataframe.copy(), title, lambda p: job.update(progress=p))
+        worker["jobs"][key] = job
+        while len(worker["jobs"]) > PDF_RESULTS_MAX:
+            worker["jobs"].popitem(last=False)
+    return key
+
+def get_report_job(key):
+    if key is None: return None
+    worker = _get_report_worker()
+    with worker["lock"]:
+        return worker["jobs"].get(key)
+
+# --- التصدير: السجل أو ملخص الساعات لفترة ومجموعة موظفين، شهراً بشهر إلى ملف على القرص ---
+EXPORT_KINDS = {"hours": "ملخص الساعات", "log": "السجل"}
+EXPORT_COLUMNS = {"hours": ["الاسم", "التاريخ", "ساعات المقر", "ساعات المنزل", "الإجمالي"], "log": LOG_COLUMNS}
+
+def _month_ranges(start, end):
+    month = datetime.strptime(start[:7], "%Y-%m")
+    while month.strftime("%Y-%m") <= end[:7]:
+        nxt = (month + timedelta(days=32)).replace(day=1)
+        yield max(start, month.strftime("%Y-%m-%d")), min(end, (nxt - timedelta(days=1)).strftime("%Y-%m-%d"))
+        month = nxt
+
+def iter_export_chunks(kind, start, end, names=(), progress=None):
+    # شهر واحد في الذاكرة كل مرة، والحركات لا تتجاوز يومها فساعات كل شهر تُحسب من حركاته وحدها
+    months = list(_month_ranges(start, end))
+    for i, (s, e) in enumerate(months):
+        df = query_logs(name=names[0] if len(names) == 1 else None, start=s, end=e)
+        if len(names) > 1: df = df[df["الاسم"].isin(names)]
+        if kind == "hours": df = calculate_daily_hours(df)
+        if not df.empty: yield df
+        if progress: progress((i + 1) / len(months))
+
+def write_export(path, fmt, kind, start, end, names=(), progress=None):
+    chunks = iter_export_chunks(kind, start, end, names, progress)
+    # ملف مؤقت يُحذف إذا فشل التصدير
+    with atomic_path(path) as tmp:
+        if fmt == "xlsx":
+            from openpyxl import Workbook
+            # write_only: الصفوف تُكتب للقرص مباشرة بدل بناء الجدول كاملاً في الذاكرة
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet(EXPORT_KINDS[kind])
+            ws.append(EXPORT_COLUMNS[kind])
+            for chunk in chunks:
+                for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None): ws.append(row)
+            wb.save(tmp)
+        else:
+            # utf-8-sig حتى يفتح Excel النص العربي بشكل صحيح
+            with open(tmp, "w", encoding="utf-8-sig", newline="") as f:
+                pd.DataFrame(columns=EXPORT_COLUMNS[kind]).to_csv(f, index=False)
+                for chunk in chunks: chunk.to_csv(f, header=False, index=False)
+    return path
+
+def _trim_exports():
+    try:
+        files = [e for e in os.scandir(EXPORT_DIR) if e.is_file() and not e.name.endswith(".tmp")]
+    except OSError:
+        return
+    for e in sorted(files, key=lambda e: e.stat().st_mtime)[:-EXPORT_FILES_MAX]:
+        try: os.remove(e.path)
+        except OSError: pass
+
+def submit_export(kind, fmt, start, end, names=()):
+    # المفتاح يشمل توقيع السجل: نفس الطلب يعيد الملف الجاهز حتى تتغير البيانات
+    names = tuple(sorted(names))
+    key = "export:" + hashlib.sha256(repr((kind, fmt, start, end, names, storage().signature(LOG_FILE))).encode()).hexdigest()
+    path = os.path.join(EXPORT_DIR, f"{kind}_{start}_{end}_{key[7:19]}.{fmt}")
+    worker = _get_report_worker()
+    with worker["lock"]:
+        job = worker["jobs"].get(key)
+        if job and (not job["future"].done() or os.path.exists(path)):
+            worker["jobs"].move_to_end(key)
+            return key
+        job = {"progress": 0.0, "path": path}
+        if os.path.exists(path):
+            job["future"] = Future(); job["future"].set_result(path)
+        else:
+            os.makedirs(EXPORT_DIR, exist_ok=True)
+            job["future"] = worker["executor"].submit(write_export, path, fmt, kind, start, end, names, lambda p: job.update(progress=p))
+        worker["jobs"][key] = job
+        while len(worker["jobs"]) > PDF_RESULTS_MAX:
+            worker["jobs"].popitem(last=False)
+    _trim_exports()
+    return key
+
 # --- Init ---
-if not os.path.exists(USERS_FILE): save_data(pd.DataFrame([{"username": "admin", "password": "123"}]), USERS_FILE)
-if not os.path.exists(SETTINGS_FILE): save_data(pd.DataFrame([{'timeout': 5, 'manual_alert_time': '0', 'manual_alert_target': 'all'}]), SETTINGS_FILE)
-if not os.path.exists(CHAT_FILE): save_data(pd.DataFrame(columns=["sender", "receiver", "message", "date", "time", "read"]), CHAT_FILE)
-if not os.path.exists(ACTIVITY_FILE): save_data(pd.DataFrame(columns=["username", "last_seen"]), ACTIVITY_FILE)
+if storage().signature(USERS_FILE) is None: save_data(pd.DataFrame([{"username": "admin", "password": "123"}]), USERS_FILE)
+if storage().signature(SETTINGS_FILE) is None: save_data(pd.DataFrame([{'timeout': 5, 'manual_alert_time': '0', 'manual_alert_target': 'all'}]), SETTINGS_FILE)
+if storage().signature(CHAT_FILE) is None: save_data(pd.DataFrame(columns=CHAT_COLUMNS), CHAT_FILE)
+if storage().signature(ACTIVITY_FILE) is None: save_data(pd.DataFrame(columns=["username", "last_seen"]), ACTIVITY_FILE)
+
+_get_inactivity_sweeper()
 
-if 'logged_in' not in st.session_state: st.session_state.update({'logged_in': False, 'username': '', 'is_admin': False, 'last_active_time': get_local_time(), 'current_status': None})
-check_inactivity()
+if 'logged_in' not in st.session_state: st.session_state.update({'logged_in': False, 'username': '', 'is_admin': False, 'current_status': None})
 
 def show_messages():
     if 'msg_text' in st.session_state and st.session_state['msg_text']:
         if st.session_state['msg_type'] == 'success':
             st.success(st.session_state['msg_text']); st.toast(st.session_state['msg_text'], icon="✅")
+        elif st.session_state['msg_type'] == 'error':
+            st.error(st.session_state['msg_text']); st.toast(st.session_state['msg_text'], icon="❌")
         else:
             st.warning(st.session_state['msg_text']); st.toast(st.session_state['msg_text'], icon="⚠️")
         st.session_state['msg_text'] = None
 
 # --- دالة فحص التنبيهات ---
+@profiled
 def check_alerts_and_notify(username):
-    history = get_chat_history(username, "admin")
-    current_count = len(history)
-    
-    if 'last_msg_count' not in st.session_state: st.session_state['last_msg_count'] = current_count
-    
     should_play_sound = False
     notification_text = ""
+    # مفاتيح الجلسة لكل مستخدم: خروج موظف ودخول آخر في نفس المتصفح لا يرث ما رآه الأول
+    seen_chat, msg_count = f"seen_chat_version:{username}", f"last_msg_count:{username}"
+    seen_alerts, manual_alert = f"seen_alerts_version:{username}", f"last_manual_alert:{username}"
 
-    if current_count > st.session_state['last_msg_count']:
-        if not history.empty and history.iloc[-1]['sender'] == 'admin':
-            should_play_sound = True
-            notification_text = "📨 رسالة جديدة من الإدارة!"
-    st.session_state['last_msg_count'] = current_count
+    # لا نقرأ المحادثة إلا إذا تغيّرت
+    if changed_since_seen(f"chat:{username}", seen_chat):
+        current_count = get_chat_count(username, "admin")
+        if msg_count not in st.session_state: st.session_state[msg_count] = current_count
+        if current_count > st.session_state[msg_count]:
+            last_msg = get_chat_history(username, "admin", last_n=1)
+            if not last_msg.empty and last_msg.iloc[-1]['sender'] == 'admin':
+                should_play_sound = True
+                notification_text = "📨 رسالة جديدة من الإدارة!"
+        st.session_state[msg_count] = current_count
 
-    settings = get_settings_cached()
-    server_alert_time = str(settings.get('manual_alert_time', '0'))
-    server_alert_target = str(settings.get('manual_alert_target', 'all'))
-    
-    if 'last_manual_alert' not in st.session_state: st.session_state['last_manual_alert'] = server_alert_time
-        
-    if server_alert_time != st.session_state['last_manual_alert']:
-        if server_alert_target == 'all' or server_alert_target == username:
-            should_play_sound = True
-            notification_text = "🔔 تنبيه إداري عاجل!"
-        st.session_state['last_manual_alert'] = server_alert_time
+    # ولا نقرأ الإعدادات إلا إذا أُرسل جرس جديد
+    if changed_since_seen("alerts", seen_alerts):
+        settings = get_settings_cached()
+        server_alert_time = str(settings.get('manual_alert_time', '0'))
+        server_alert_target = str(settings.get('manual_alert_target', 'all'))
+        if manual_alert not in st.session_state: st.session_state[manual_alert] = server_alert_time
+        if server_alert_time != st.session_state[manual_alert]:
+            if server_alert_target == 'all' or server_alert_target == username:
+                should_play_sound = True
+                notification_text = "🔔 تنبيه إداري عاجل!"
+            st.session_state[manual_alert] = server_alert_time
 
     if should_play_sound:
-        st.markdown(f"""<audio autoplay><source src="{NOTIFICATION_SOUND_URL}" type="audio/ogg"></audio>""", unsafe_allow_html=True)
+        st.markdown(audio_html(*get_bell_audio()), unsafe_allow_html=True)
         if notification_text: st.toast(notification_text, icon="🔔")
 
+# --- صفحة المحادثة: آخر CHAT_PAGE_SIZE رسالة مع زر لتحميل الأقدم ---
+def show_older_messages_button(user1, user2, key):
+    pages = st.session_state.get(key, 1)
+    if get_chat_count(user1, user2) > pages * CHAT_PAGE_SIZE:
+        if st.button("⬆️ رسائل أقدم", key=f"{key}_btn"):
+            pages += 1; st.session_state[key] = pages
+    return get_chat_history(user1, user2, last_n=pages * CHAT_PAGE_SIZE)
+
+# --- عارض السجل: الفلاتر تُنفَّذ في التخزين، ولا يُحمَّل ويُلوَّن إلا صفوف الصفحة المعروضة ---
+def log_viewer(key, name=None, employees=None):
+    c1, c2, c3 = st.columns(3)
+    if employees is not None:
+        sel = c1.selectbox("الموظف:", ["الجميع"] + list(employees), key=f"{key}_emp")
+        name = None if sel == "الجميع" else sel
+    dates = c2.date_input("الفترة:", value=(), key=f"{key}_dates")
+    actions = c3.multiselect("الحركة:", PUNCH_ACTIONS, key=f"{key}_actions")
+    start = dates[0].strftime("%Y-%m-%d") if len(dates) else None
+    end = dates[-1].strftime("%Y-%m-%d") if len(dates) else None
+    # تغيير الفلاتر يعيد العرض للصفحة الأولى
+    filters = (name, start, end, tuple(actions))
+    if st.session_state.get(f"{key}_filters") != filters: st.session_state.update({f"{key}_filters": filters, f"{key}_page": 0})
+    page = st.session_state[f"{key}_page"]
+    df, total = query_logs_page(name, start, end, actions, page)
+    pages = max((total + LOG_PAGE_SIZE - 1) // LOG_PAGE_SIZE, 1)
+    if page >= pages:
+        page = st.session_state[f"{key}_page"] = pages - 1
+        df, total = query_logs_page(name, start, end, actions, page)
+    if df.empty:
+        st.info("السجل فارغ.")
+        return
+    st.dataframe(style_data(df), use_container_width=True, hide_index=True)
+    c1, c2, c3 = st.columns([1, 2, 1])
+    if c1.button("→ الأحدث", key=f"{key}_prev", disabled=page == 0):
+        st.session_state[f"{key}_page"] = page - 1; st.rerun()
+    c2.caption(f"صفحة {page + 1} من {pages} — {total} حركة")
+    if c3.button("الأقدم ←", key=f"{key}_next", disabled=page >= pages - 1):
+        st.session_state[f"{key}_page"] = page + 1; st.rerun()
+
+# --- الأجزاء الحية: تُعاد كل LIVE_REFRESH_SECONDS وحدها، وبقية الصفحة تُرسم فقط عند تفاعل المستخدم ---
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+@profiled(page="employee")
+def employee_live(username):
+    # نبضة كل LIVE_REFRESH_SECONDS ما دامت الصفحة مفتوحة (للوحة "نشط الآن" وللفاحص)
+    save_user_activity(username)
+    check_auto_logout(username)
+    check_alerts_and_notify(username)
+
+def _render_chat(history, me, empty_text, empty_widget=st.write):
+    with st.container(height=400):
+        if not history.empty:
+            for _, row in history.iterrows():
+                role = "user" if row['sender'] == me else "assistant"
+                with st.chat_message(role):
+                    st.write(row['message']); st.caption(f"{row['time']}")
+        else: empty_widget(empty_text)
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+@profiled(page="employee")
+def chat_pane(username, other, key):
+    _render_chat(show_older_messages_button(username, other, key), username, "ابدأ المحادثة...")
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+@profiled(page="admin")
+def admin_status_panel():
+    users_df = load_data(USERS_FILE, ["username"])
+    employees = users_df[users_df['username'] != 'admin']['username'].tolist()
+    now = get_local_time()
+    today_str = now.strftime("%Y-%m-%d")
+    status_df = compute_employee_status(employees, query_logs(start=today_str, end=today_str), get_presence_snapshot(), now)
+    if not status_df.empty:
+        st.markdown("  \n".join(f"{icon} **{emp}**: {text}" for emp, icon, text in status_df.itertuples(index=False)))
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+@profiled(page="admin")
+def admin_inbox():
+    users_df = load_data(USERS_FILE, ["username"])
+    emp_list = users_df[users_df['username'] != 'admin']['username'].tolist()
+    # خيارات القائمة ثابتة حتى لا يضيع الاختيار عند تغير حالة القراءة
+    unread = [emp for emp in emp_list if get_unread_count("admin", emp)]
+    if unread: st.caption("🔴 رسائل غير مقروءة: " + "، ".join(unread))
+    selected_emp = st.selectbox("اختر الموظف:", emp_list, key="inbox_emp")
+    if selected_emp:
+        mark_as_read("admin", selected_emp)
+        _render_chat(show_older_messages_button("admin", selected_emp, f"chat_pages_{selected_emp}"), "admin", "لا توجد رسائل.", st.info)
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+@profiled(page="admin")
+def job_progress(key, text):
+    # يتابع التقدم فقط، وعند الانتهاء يعيد رسم الصفحة مرة واحدة لعرض زر التحميل (خارج الجزء الحي)
+    job = get_report_job(key)
+    if job and not job["future"].done(): st.progress(job["progress"], text=text)
+    else: st.rerun()
+
+def export_job_status():
+    key = st.session_state.get('export_job')
+    job = get_report_job(key)
+    if not job: return
+    if not job["future"].done(): job_progress(key, "جاري تجهيز الملف...")
+    elif job["future"].exception(): st.error(f"تعذر التصدير: {job['future'].exception()}")
+    elif os.path.exists(job["path"]):
+        with open(job["path"], "rb") as f:
+            st.download_button(f"⬇️ {os.path.basename(job['path'])}", f, os.path.basename(job["path"]), key="export_dl")
+
+def pdf_job_status():
+    key = st.session_state.get('pdf_job')
+    job = get_report_job(key)
+    if not job: return
+    if not job["future"].done(): job_progress(key, "جاري إنشاء التقرير...")
+    elif job["future"].result(): st.download_button("PDF", job["future"].result(), "sum.pdf", "application/pdf")
+
 # --- Pages ---
 def login_page():
     st.title("🔒 تسجيل الدخول")
@@ -328,19 +1732,17 @@ def login_page():
     if st.button("دخول"):
         match = users[(users['username'] == u) & (users['password'] == p)]
         if not match.empty:
-            st.session_state.update({'logged_in': True, 'username': u, 'is_admin': (u == "admin"), 'last_active_time': get_local_time()})
-            logs = load_data(LOG_FILE, ["الاسم", "نوع الحركة"])
-            if not logs.empty:
-                last = logs[logs['الاسم'] == u].tail(1)
-                if not last.empty:
-                    if "دخول مقر" in last.iloc[0]['نوع الحركة']: st.session_state['current_status'] = "مقر"
-                    elif "دخول منزلي" in last.iloc[0]['نوع الحركة']: st.session_state['current_status'] = "منزل"
+            st.session_state.update({'logged_in': True, 'username': u, 'is_admin': (u == "admin")})
+            last = last_log_entry(u)
+            if last is not None:
+                if "دخول مقر" in str(last['نوع الحركة']): st.session_state['current_status'] = "مقر"
+                elif "دخول منزلي" in str(last['نوع الحركة']): st.session_state['current_status'] = "منزل"
             st.rerun()
         else: st.error("خطأ")
 
 def employee_view(username):
     update_activity()
-    check_alerts_and_notify(username)
+    employee_live(username)
     st.header(f"أهلاً {username}")
     show_messages()
     
@@ -358,99 +1760,47 @@ def employee_view(username):
         c1, c2 = st.columns(2)
         if place == "مقر الشركة":
             if c1.button("🟢 دخول مقر", use_container_width=True):
-                st.session_state['current_status'] = "مقر"; record_action(username, "دخول مقر"); st.rerun()
+                if record_action(username, "دخول مقر"): st.session_state['current_status'] = "مقر"
+                st.rerun()
             if c2.button("🔴 خروج مقر", use_container_width=True):
-                st.session_state['current_status'] = None; record_action(username, "خروج مقر"); st.rerun()
+                if record_action(username, "خروج مقر"): st.session_state['current_status'] = None
+                st.rerun()
         else:
             if c1.button("🟢 دخول منزلي", use_container_width=True):
-                st.session_state['current_status'] = "منزل"; record_action(username, "دخول منزلي"); st.rerun()
+                if record_action(username, "دخول منزلي"): st.session_state['current_status'] = "منزل"
+                st.rerun()
             if c2.button("🔴 خروج منزلي", use_container_width=True):
-                st.session_state['current_status'] = None; record_action(username, "خروج منزلي"); st.rerun()
+                if record_action(username, "خروج منزلي"): st.session_state['current_status'] = None
+                st.rerun()
         
         st.divider()
         st.caption("سجل الحركات:")
-        df = load_data(LOG_FILE, ["الاسم", "نوع الحركة", "التاريخ", "الوقت"])
-        if not df.empty:
-            user_logs = df[df["الاسم"] == username].iloc[::-1]
-            st.dataframe(style_data(user_logs), use_container_width=True)
+        log_viewer(f"my_log_{username}", name=username)
 
     with tab2:
         st.subheader("مراسلة الإدارة")
-        history = get_chat_history(username, "admin")
-        chat_container = st.container(height=400)
-        with chat_container:
-            if not history.empty:
-                for _, row in history.iterrows():
-                    role = "user" if row['sender'] == username else "assistant"
-                    with st.chat_message(role):
-                        st.write(row['message']); st.caption(f"{row['time']}")
-            else: st.write("ابدأ المحادثة...")
+        chat_pane(username, "admin", "chat_pages")
         if prompt := st.chat_input("اكتب رسالة..."):
-            send_message(username, "admin", prompt); st.rerun()
+            try: send_message(username, "admin", prompt)
+            except STORAGE_ERRORS as e: st.error(f"❌ تعذر إرسال الرسالة: {e}")
+            else: st.rerun()
 
 def admin_view():
     update_activity()
     st.header("🛠 الأدمن")
+    if getattr(storage(), "legacy_error", None): st.error(f"⚠️ لم يُرحَّل السجل القديم: {storage().legacy_error}")
     
     # --- الشريط الجانبي: حالة الموظفين المحدثة ---
     with st.sidebar:
         st.markdown("---")
         st.subheader("📊 حالة الموظفين (مباشر)")
-        
-        # تحميل البيانات
-        users_df = load_data(USERS_FILE, ["username"])
-        activity_df = load_data(ACTIVITY_FILE, ["username", "last_seen"])
-        logs_df = load_data(LOG_FILE, ["الاسم", "نوع الحركة", "التاريخ"])
-        
-        employees = users_df[users_df['username'] != 'admin']['username'].tolist()
-        
-        now = get_local_time()
-        today_str = now.strftime("%Y-%m-%d")
-        
-        for emp in employees:
-            status_icon = "🔴"
-            status_text = "أوف لاين"
-            
-            # 1. التحقق: هل آخر حركة له اليوم هي دخول؟
-            is_checked_in = False
-            if not logs_df.empty:
-                emp_logs = logs_df[(logs_df['الاسم'] == emp) & (logs_df['التاريخ'] == today_str)]
-                if not emp_logs.empty:
-                    last_action = str(emp_logs.iloc[-1]['نوع الحركة'])
-                    if "دخول" in last_action:
-                        is_checked_in = True
-            
-            if is_checked_in:
-                # 2. التحقق: هل هو نشط الآن؟
-                if not activity_df.empty:
-                    user_act = activity_df[activity_df['username'] == emp]
-                    if not user_act.empty:
-                        last_seen_str = user_act.iloc[0]['last_seen']
-                        try:
-                            last_seen_time = datetime.strptime(last_seen_str, "%Y-%m-%d %H:%M:%S")
-                            # إذا كان نشطاً خلال آخر 30 ثانية
-                            diff_seconds = (now - last_seen_time).total_seconds()
-                            if diff_seconds < 30: 
-                                status_icon = "🟢"
-                                status_text = "نشط الآن"
-                            elif diff_seconds < 300: # أقل من 5 دقائق
-                                status_icon = "🟡"
-                                status_text = "خامل"
-                            else:
-                                status_icon = "🟠"
-                                status_text = "خامل جداً"
-                        except:
-                            status_icon = "🟡"
-                            status_text = "غير معروف"
-            
-            st.markdown(f"{status_icon} **{emp}**: {status_text}")
-
-    t1, t2, t3, t4, t5, t6 = st.tabs(["⏱ الساعات", "📝 السجل", "👥 الموظفين", "🖐️ يدوي", "⚙️ إعدادات", "💬 الدردشة"])
+        admin_status_panel()
+
+    t1, t2, t3, t4, t5, t6, t7, t8 = st.tabs(["⏱ الساعات", "📊 الملخص", "📝 السجل", "👥 الموظفين", "🖐️ يدوي", "⚙️ إعدادات", "💬 الدردشة", "📈 الأداء"])
     
     with t1:
         if st.button("🔄 تحديث"): st.rerun()
-        raw = load_data(LOG_FILE, ["الاسم", "نوع الحركة", "التاريخ", "الوقت"])
-        res = calculate_daily_hours(raw)
+        res = hours_rollup("day")
         if not res.empty:
             filter_mode = st.radio("تصفية:", ["الجميع", "موظف محدد"], horizontal=True, key="h_filter")
             if filter_mode == "موظف محدد":
@@ -458,44 +1808,86 @@ def admin_view():
                 sel_emp = st.selectbox("اختر الموظف:", emp_list, key="h_emp")
                 res = res[res["الاسم"] == sel_emp]
             st.dataframe(res, use_container_width=True)
-            c1, c2 = st.columns(2)
-            c1.download_button("Excel", res.to_csv(index=False).encode('utf-8'), "sum.csv")
-            if c2.button("PDF"): 
-                pdf = generate_pdf(res, "ملخص الساعات"); 
-                if pdf: c2.download_button("PDF", pdf, "sum.pdf", "application/pdf")
+            if st.button("PDF"): st.session_state['pdf_job'] = submit_pdf_report(res, "ملخص الساعات")
+            pdf_job_status()
         else: st.info("لا توجد بيانات.")
 
+        with st.expander("📤 تصدير (Excel / CSV)"):
+            users_df = load_data(USERS_FILE, ["username"])
+            c1, c2 = st.columns(2)
+            kind = c1.radio("المحتوى:", list(EXPORT_KINDS), format_func=EXPORT_KINDS.get, horizontal=True, key="exp_kind")
+            fmt = c2.radio("الصيغة:", ["xlsx", "csv"] if XLSX_AVAILABLE else ["csv"], horizontal=True, key="exp_fmt")
+            today = get_local_time().date()
+            dates = st.date_input("الفترة:", (today.replace(day=1), today), key="exp_dates")
+            names = st.multiselect("الموظفون (فارغ = الجميع):", users_df[users_df['username'] != 'admin']['username'].tolist(), key="exp_names")
+            if st.button("تجهيز الملف", disabled=len(dates) != 2):
+                st.session_state['export_job'] = submit_export(kind, fmt, dates[0].strftime("%Y-%m-%d"), dates[1].strftime("%Y-%m-%d"), names)
+            export_job_status()
+
     with t2:
-        df_logs = load_data(LOG_FILE, ["الاسم", "نوع الحركة", "التاريخ", "الوقت"])
-        if not df_logs.empty:
-            filter_mode_log = st.radio("عرض:", ["الجميع", "موظف محدد"], horizontal=True, key="l_filter")
-            if filter_mode_log == "موظف محدد":
-                emp_list_log = df_logs["الاسم"].unique()
-                sel_emp_log = st.selectbox("اختر الموظف:", emp_list_log, key="l_emp")
-                df_logs = df_logs[df_logs["الاسم"] == sel_emp_log]
-            df_logs = df_logs.iloc[::-1]
-            st.dataframe(style_data(df_logs), use_container_width=True)
-        else: st.info("السجل فارغ.")
+        c1, c2 = st.columns(2)
+        period = c1.radio("الفترة:", ["month", "week"], format_func=lambda p: "شهري" if p == "month" else "أسبوعي (من الأحد)", horizontal=True, key="sum_period")
+        users_df = load_data(USERS_FILE, ["username"])
+        sel = c2.selectbox("الموظف:", ["الجميع"] + users_df[users_df['username'] != 'admin']['username'].tolist(), key="sum_emp")
+        summary = hours_rollup(period, name=None if sel == "الجميع" else sel)
+        if not summary.empty:
+            # الأحدث أولاً
+            st.dataframe(summary.sort_values(ROLLUP_PERIODS[period], ascending=False, kind="stable"), use_container_width=True, hide_index=True)
+        else: st.info("لا توجد بيانات.")
+        if st.button("♻️ إعادة البناء من السجل"): rebuild_rollups(); st.rerun()
 
     with t3:
+        users_df = load_data(USERS_FILE, ["username"])
+        log_viewer("admin_log", employees=users_df[users_df['username'] != 'admin']['username'].tolist())
+
+    with t4:
         users = load_data(USERS_FILE, ["username", "password"])
         st.dataframe(users)
         c1, c2 = st.columns(2)
         u, p = c1.text_input("اسم"), c2.text_input("سر")
         if st.button("إضافة"): 
-            if u and p: save_data(pd.concat([users, pd.DataFrame([{"username": u, "password": p}])], ignore_index=True), USERS_FILE); st.success("تم"); st.rerun()
+            if u and p: modify_data(USERS_FILE, ["username", "password"], lambda users: pd.concat([users, pd.DataFrame([{"username": u, "password": p}])], ignore_index=True)); st.success("تم"); st.rerun()
 
-    with t4:
+    with t5:
         st.subheader("إضافة يدوية")
         users = load_data(USERS_FILE, ["username", "password"])
         with st.form("manual"):
             sel_u = st.selectbox("موظف", users['username'])
-            act = st.selectbox("حركة", ["دخول مقر", "خروج مقر", "دخول منزلي", "خروج منزلي"])
+            act = st.selectbox("حركة", PUNCH_ACTIONS)
             d = st.date_input("تاريخ", get_local_time())
             t = st.time_input("وقت (ثابت 9:00)", time(9,0))
             if st.form_submit_button("حفظ"):
                 row = {"الاسم": sel_u, "نوع الحركة": act, "التاريخ": d.strftime("%Y-%m-%d"), "الوقت": t.strftime("%H:%M:%S")}
-                save_data(pd.concat([load_data(LOG_FILE, ["الاسم", "نوع الحركة", "التاريخ", "الوقت"]), pd.DataFrame([row])], ignore_index=True), LOG_FILE); st.success("تم")
+                new_rows, rejected = prepare_punch_import(pd.DataFrame([row]))
+                try:
+                    if import_punches(new_rows): st.success("تم")
+                    else: st.warning(f"⚠️ {rejected['السبب'].iloc[0]}")
+                except STORAGE_ERRORS as e: st.error(f"❌ تعذر الحفظ: {e}")
+
+        st.divider()
+        st.subheader("📥 استيراد جماعي (CSV / Excel)")
+        if st.session_state.get('import_msg'): st.success(st.session_state.pop('import_msg'))
+        st.caption("الأعمدة: " + "، ".join(LOG_COLUMNS) + " — والحركات: " + "، ".join(PUNCH_ACTIONS))
+        upload_n = st.session_state.get('punch_upload_n', 0)
+        uploaded = st.file_uploader("ملف الحركات", type=["csv", "xlsx"], key=f"punch_upload_{upload_n}")
+        if uploaded is not None:
+            try:
+                new_rows, rejected = prepare_punch_import(read_punch_file(uploaded))
+            except Exception as e:
+                st.error(f"تعذرت قراءة الملف: {e}")
+            else:
+                c1, c2 = st.columns(2)
+                c1.metric("حركات جديدة", len(new_rows)); c2.metric("مرفوضة", len(rejected))
+                if not rejected.empty:
+                    st.caption("المرفوضة:"); st.dataframe(rejected, use_container_width=True)
+                if not new_rows.empty:
+                    st.caption("ستُضاف:"); st.dataframe(new_rows, use_container_width=True, hide_index=True)
+                    if st.button(f"✅ اعتماد {len(new_rows)} حركة", use_container_width=True):
+                        try: count = import_punches(new_rows)
+                        except STORAGE_ERRORS as e: st.error(f"❌ تعذر الاستيراد: {e}")
+                        else:
+                            st.session_state.update({'import_msg': f"تم استيراد {count} حركة", 'punch_upload_n': upload_n + 1})
+                            st.rerun()
         
         st.divider()
         st.subheader("🔔 إرسال جرس تنبيه")
@@ -507,42 +1899,56 @@ def admin_view():
             trigger_manual_alert(target_code)
             st.toast(f"تم إرسال الجرس لـ: {target_user_alert}", icon="📢")
 
-    with t5:
+    with t6:
         st.subheader("⚙️ إعدادات")
         current_settings = get_settings_cached()
         cur_timeout = int(current_settings.get('timeout', 5))
         new_t = st.number_input("دقائق خمول المنزل:", 1, 120, cur_timeout)
         if st.button("حفظ"): update_settings(timeout=new_t); st.success("تم"); st.rerun()
 
-    with t6:
+        st.divider()
+        st.subheader("🗄️ التخزين")
+        st.caption(f"المحرك الحالي: {storage().name}")
+        if storage().name == "csv" and st.button("ترحيل البيانات إلى SQLite"):
+            counts = migrate_csv_to_sqlite(SQLITE_FILE)
+            st.success("تم الترحيل: " + "، ".join(f"{f} ({n})" for f, n in counts.items()))
+            st.info("لتفعيل SQLite شغّل التطبيق مع ATTENDANCE_STORAGE=sqlite")
+
+    with t7:
         st.subheader("📨 البريد الوارد (فوري)")
-        users_df = load_data(USERS_FILE, ["username"])
-        emp_list = users_df[users_df['username'] != 'admin']['username'].tolist()
-        chat_df = load_data(CHAT_FILE, ["sender", "read"])
-        emp_display_list = []
-        for emp in emp_list:
-            has_unread = not chat_df[(chat_df['sender'] == emp) & (chat_df['read'] == "False")].empty
-            emp_display_list.append(f"🔴 {emp}" if has_unread else emp)
-        selected_emp_str = st.selectbox("اختر الموظف:", emp_display_list)
-        selected_emp = selected_emp_str.replace("🔴 ", "")
+        admin_inbox()
+        selected_emp = st.session_state.get("inbox_emp")
         if selected_emp:
-            mark_as_read("admin", selected_emp)
-            history = get_chat_history("admin", selected_emp)
-            chat_container_admin = st.container(height=400)
-            with chat_container_admin:
-                if not history.empty:
-                    for _, row in history.iterrows():
-                        role = "user" if row['sender'] == "admin" else "assistant"
-                        with st.chat_message(role):
-                            st.write(row['message']); st.caption(f"{row['time']}")
-                else: st.info("لا توجد رسائل.")
             if prompt := st.chat_input("رد على الموظف..."):
-                send_message("admin", selected_emp, prompt); st.rerun()
+                try: send_message("admin", selected_emp, prompt)
+                except STORAGE_ERRORS as e: st.error(f"❌ تعذر إرسال الرسالة: {e}")
+                else: st.rerun()
 
-if not st.session_state['logged_in']: login_page()
-else:
-    with st.sidebar:
-        st.write(f"👤 {st.session_state['username']}")
-        if st.button("خروج"): st.session_state.update({'logged_in': False, 'username': '', 'is_admin': False}); st.rerun()
-    if st.session_state['is_admin']: admin_view()
-    else: employee_view(st.session_state['username'])
+    with t8:
+        st.subheader("📈 الأداء")
+        _profiler["enabled"] = st.toggle("تفعيل القياس", _profiler["enabled"], key="profile_toggle")
+        samples = profile_samples()
+        if samples.empty: st.info("لا توجد قياسات بعد." if _profiler["enabled"] else "القياس متوقف.")
+        else:
+            summary = profile_summary(samples)
+            st.caption(f"آخر {len(samples)} قياس (الحد {PROFILE_BUFFER_SIZE})")
+            st.markdown("**إعادة التشغيل لكل صفحة**")
+            st.dataframe(summary[summary["kind"] == "rerun"].drop(columns="kind"), use_container_width=True, hide_index=True)
+            st.markdown("**الدوال**")
+            st.dataframe(summary[summary["kind"] == "call"].drop(columns="kind"), use_container_width=True, hide_index=True)
+            c1, c2, c3 = st.columns(3)
+            c1.download_button("CSV", samples.to_csv(index=False).encode('utf-8'), PROFILE_EXPORT_FILE)
+            if c2.button("💾 حفظ في ملف"): samples.to_csv(PROFILE_EXPORT_FILE, index=False); st.success(f"تم: {os.path.abspath(PROFILE_EXPORT_FILE)}")
+            if c3.button("🗑️ مسح"):
+                with _profiler["lock"]: _profiler["samples"].clear()
+                st.rerun()
+
+page = "login" if not st.session_state['logged_in'] else "admin" if st.session_state['is_admin'] else "employee"
+with profile_rerun(page):
+    if page == "login": login_page()
+    else:
+        with st.sidebar:
+            st.write(f"👤 {st.session_state['username']}")
+            if st.button("خروج"): st.session_state.update({'logged_in': False, 'username': '', 'is_admin': False}); st.rerun()
+        if page == "admin": admin_view()
+        else: employee_view(st.session_state['username'])
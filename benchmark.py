@@ -0,0 +1,224 @@
+# --- قياس أداء app.py على بيانات مولّدة بأحجام مختلفة ---
+# الاستخدام:
+#   python benchmark.py --scales 50x30,200x90 --sessions 50 --output bench.json
+# كل حجم (موظفين x أيام) يعمل في عملية مستقلة داخل مجلد مؤقت، والنتيجة JSON للمقارنة بين النسخ.
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_COLUMNS = ["الاسم", "نوع الحركة", "التاريخ", "الوقت"]
+CHAT_COLUMNS = ["sender", "receiver", "message", "date", "time", "read"]
+
+# --- توليد البيانات (بنفس أعمدة ملفات التطبيق) ---
+def generate_dataset(path, employees, days, messages, seed=0):
+    import pandas as pd
+    rng = random.Random(seed)
+    names = [f"emp{i:04d}" for i in range(employees)]
+    start = datetime.now() - timedelta(days=days)
+    log_rows, chat_rows, activity_rows = [], [], []
+    for day in range(days):
+        date = (start + timedelta(days=day)).strftime("%Y-%m-%d")
+        for name in names:
+            roll = rng.random()
+            if roll < 0.1: continue  # غياب
+            place = "منزلي" if roll > 0.75 else "مقر"
+            t_in = timedelta(hours=rng.uniform(7.5, 10))
+            t_out = t_in + timedelta(hours=rng.uniform(4, 9))
+            fmt = lambda td: (datetime(2000, 1, 1) + td).strftime("%H:%M:%S")
+            if roll < 0.95: log_rows.append((name, f"دخول {place}", date, fmt(t_in)))
+            # حركات يتيمة: دخول بلا خروج أو خروج بلا دخول
+            if roll < 0.9 or roll >= 0.95: log_rows.append((name, f"خروج {place}", date, fmt(t_out)))
+    for name in names:
+        for i in range(messages):
+            when = start + timedelta(days=rng.uniform(0, days))
+            sender, receiver = (name, "admin") if i % 2 == 0 else ("admin", name)
+            chat_rows.append((sender, receiver, f"رسالة {i}", when.strftime("%Y-%m-%d"), when.strftime("%H:%M:%S"), "True"))
+        chat_rows.sort(key=lambda r: (r[3], r[4]))
+        activity_rows.append((name, (datetime.now() - timedelta(seconds=rng.uniform(0, 600))).strftime("%Y-%m-%d %H:%M:%S")))
+    users = [("admin", "123")] + [(n, "1") for n in names]
+    pd.DataFrame(users, columns=["username", "password"]).to_csv(os.path.join(path, "users.csv"), index=False)
+    pd.DataFrame(log_rows, columns=LOG_COLUMNS).to_csv(os.path.join(path, "attendance_log.csv"), index=False)
+    pd.DataFrame(chat_rows, columns=CHAT_COLUMNS).to_csv(os.path.join(path, "chat_history.csv"), index=False)
+    pd.DataFrame(activity_rows, columns=["username", "last_seen"]).to_csv(os.path.join(path, "user_activity.csv"), index=False)
+    pd.DataFrame([{'timeout': 5, 'manual_alert_time': '0', 'manual_alert_target': 'all'}]).to_csv(os.path.join(path, "settings.csv"), index=False)
+    return names, len(log_rows), len(chat_rows)
+
+# --- أدوات القياس ---
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def summarize(samples):
+    ms = [s * 1000 for s in samples]
+    return {"repeat": len(ms), "mean_ms": round(sum(ms) / len(ms), 3), "p50_ms": round(percentile(ms, 50), 3),
+            "p95_ms": round(percentile(ms, 95), 3), "max_ms": round(max(ms), 3)}
+
+def timed(fn, repeat, setup=None):
+    samples = []
+    for i in range(repeat):
+        if setup: setup(i)
+        t0 = time.perf_counter(); fn(i); samples.append(time.perf_counter() - t0)
+    return summarize(samples)
+
+# --- جلسات متزامنة تستطلع كل poll ثانية بنفس دوال الجزء الحي employee_live (ولوحة الأدمن لكل 10 جلسات) ---
+class ThreadSessionState(threading.local):
+    # في وضع bare تشترك كل الخيوط في st.session_state واحدة، فنعطي كل جلسة (خيط) حالتها
+    def __init__(self): self.__dict__["data"] = {}
+    def __getattr__(self, key): return getattr(self.data, key)
+    def __getitem__(self, key): return self.data[key]
+    def __setitem__(self, key, value): self.data[key] = value
+    def __delitem__(self, key): del self.data[key]
+    def __contains__(self, key): return key in self.data
+
+def simulate_sessions(app, names, sessions, poll, duration):
+    latencies, lock, stop = [], threading.Lock(), threading.Event()
+    real_state, app.st.session_state = app.st.session_state, ThreadSessionState()
+    def session(i):
+        name = names[i % len(names)]
+        # حالة الجلسة بعد الدخول كما في login_page/employee_view
+        last = app.last_log_entry(name)
+        status = {"دخول مقر": "مقر", "دخول منزلي": "منزل"}.get(last["نوع الحركة"]) if last else None
+        app.st.session_state.update(logged_in=True, username=name, is_admin=False, current_status=status)
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            app.save_user_activity(name); app.check_auto_logout(name); app.check_alerts_and_notify(name)
+            if i % 10 == 0:
+                today = app.get_local_time().strftime("%Y-%m-%d")
+                app.compute_employee_status(names, app.query_logs(start=today, end=today), app.get_presence_snapshot(), app.get_local_time())
+            elapsed = time.perf_counter() - t0
+            with lock: latencies.append(elapsed)
+            stop.wait(max(0.0, poll - elapsed))
+    threads = [threading.Thread(target=session, args=(i,), daemon=True) for i in range(sessions)]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    time.sleep(duration); stop.set()
+    for t in threads: t.join()
+    app.st.session_state = real_state
+    result = summarize(latencies) if latencies else {"repeat": 0}
+    result.update(sessions=sessions, poll_seconds=poll, polls_per_second=round(len(latencies) / (time.perf_counter() - t0), 2))
+    return result
+
+# --- تشغيل حجم واحد (داخل عملية مستقلة) ---
+def run_scale(args):
+    os.environ.setdefault("ATTENDANCE_TTS", "offline")
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+    # الفاحص يُقاس مباشرة أدناه بدل أن يعمل في الخلفية أثناء القياس
+    os.environ.setdefault("ATTENDANCE_SWEEP_SECONDS", "0")
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    work = tempfile.mkdtemp(prefix="attendance-bench-")
+    names, log_rows, chat_rows = generate_dataset(work, args.employees, args.days, args.messages, args.seed)
+    shutil.copy(os.path.join(APP_DIR, "Amiri-Regular.ttf"), work)
+    os.chdir(work)
+    sys.path.insert(0, APP_DIR)
+    t0 = time.perf_counter()
+    import app  # يشغّل صفحة الدخول في وضع bare ويرحّل السجل إلى أقسام شهرية
+    startup = time.perf_counter() - t0
+    results = {"startup": summarize([startup])}
+    r = args.repeat
+    cold = lambda i: app.invalidate_cache()
+
+    results["load_data(log) cold"] = timed(lambda i: app.load_data(app.LOG_FILE, LOG_COLUMNS), r, cold)
+    results["load_data(log) warm"] = timed(lambda i: app.load_data(app.LOG_FILE, LOG_COLUMNS), r)
+    results["load_data(chat) cold"] = timed(lambda i: app.load_data(app.CHAT_FILE, CHAT_COLUMNS), r, cold)
+    users = app.load_data(app.USERS_FILE, ["username", "password"])
+    results["save_data(users)"] = timed(lambda i: app.save_data(users, app.USERS_FILE), r)
+    results["query_logs(employee)"] = timed(lambda i: app.query_logs(name=names[i % len(names)]), r)
+    results["query_logs_page(all, newest)"] = timed(lambda i: app.query_logs_page(), r)
+    results["query_logs_page(employee, page 2)"] = timed(lambda i: app.query_logs_page(name=names[i % len(names)], page=1), r)
+    results["last_log_entry"] = timed(lambda i: app.last_log_entry(names[i % len(names)]), r)
+
+    raw = app.load_data(app.LOG_FILE, LOG_COLUMNS)
+    results["calculate_daily_hours"] = timed(lambda i: app.calculate_daily_hours(raw), max(1, r // 5))
+    app.invalidate_cache()
+    results["rebuild_rollups"] = timed(lambda i: app.rebuild_rollups(), max(1, r // 5))
+    results["record_action"] = timed(lambda i: app.record_action(names[i % len(names)], "خروج مقر"), r)
+    results["hours_rollup(day) after punch"] = timed(lambda i: app.hours_rollup("day"), r,
+                                                     lambda i: app.record_action(names[i % len(names)], "دخول منزلي"))
+    results["hours_rollup(month)"] = timed(lambda i: app.hours_rollup("month"), r)
+
+    results["get_chat_history(page)"] = timed(lambda i: app.get_chat_history(names[i % len(names)], "admin", last_n=app.CHAT_PAGE_SIZE), r)
+    results["get_chat_history(full)"] = timed(lambda i: app.get_chat_history(names[i % len(names)], "admin"), r)
+    results["send_message"] = timed(lambda i: app.send_message(names[i % len(names)], "admin", "bench"), r)
+    results["mark_as_read"] = timed(lambda i: app.mark_as_read("admin", names[i % len(names)]), r,
+                                    lambda i: app.send_message(names[i % len(names)], "admin", "bench"))
+    results["sweep_inactive_sessions"] = timed(lambda i: app.sweep_inactive_sessions(), r)
+    results["save_user_activity"] = timed(lambda i: app.save_user_activity(names[i % len(names)]), r * 10)
+    results["flush_presence"] = timed(lambda i: app.flush_presence(), r, lambda i: app.save_user_activity(names[i % len(names)]))
+
+    now = app.get_local_time(); today = now.strftime("%Y-%m-%d")
+    results["compute_employee_status"] = timed(
+        lambda i: app.compute_employee_status(names, app.query_logs(start=today, end=today), app.get_presence_snapshot(), now), r)
+
+    hours = app.calculate_daily_hours(raw).head(args.pdf_rows)
+    results["generate_pdf"] = timed(lambda i: app.generate_pdf(hours, "bench"), 1)
+    results["generate_pdf"]["rows"] = len(hours)
+
+    if args.sessions:
+        results["concurrent_sessions"] = simulate_sessions(app, names, args.sessions, args.poll, args.duration)
+
+    scale = {"scale": f"{args.employees}x{args.days}", "employees": args.employees, "days": args.days,
+             "log_rows": log_rows, "chat_rows": chat_rows, "storage": app.storage().name}
+    return [dict(scale, op=op, **stats) for op, stats in results.items()]
+
+def _app_version():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    with open(os.path.join(APP_DIR, "app.py"), "rb") as f:
+        return {"commit": commit, "app_sha256": hashlib.sha256(f.read()).hexdigest()[:16]}
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس أداء نظام الحضور على بيانات مولّدة")
+    parser.add_argument("--scales", default="50x30,200x90,500x365", help="قائمة موظفين x أيام")
+    parser.add_argument("--messages", type=int, default=20, help="رسائل لكل موظف")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--pdf-rows", type=int, default=2000)
+    parser.add_argument("--sessions", type=int, default=50, help="عدد الجلسات المتزامنة (0 للتعطيل)")
+    parser.add_argument("--poll", type=float, default=3.0, help="فترة الاستطلاع بالثواني")
+    parser.add_argument("--duration", type=float, default=10.0, help="مدة محاكاة الجلسات بالثواني")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="ملف JSON للنتائج (الافتراضي: الطباعة)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--employees", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--days", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        json.dump(run_scale(args), sys.stdout, ensure_ascii=False)
+        return
+
+    results = []
+    for scale in args.scales.split(","):
+        employees, days = (int(x) for x in scale.lower().split("x"))
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", "--employees", str(employees), "--days", str(days),
+               "--messages", str(args.messages), "--repeat", str(args.repeat), "--pdf-rows", str(args.pdf_rows),
+               "--sessions", str(args.sessions), "--poll", str(args.poll), "--duration", str(args.duration), "--seed", str(args.seed)]
+        print(f"⏱ {scale} ...", file=sys.stderr)
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            sys.exit(proc.returncode)
+        results += json.loads(proc.stdout)
+    report = {"meta": dict(_app_version(), python=platform.python_version(), created=datetime.now().isoformat(timespec="seconds")),
+              "results": results}
+    text = json.dumps(report, ensure_ascii=False, indent=1)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
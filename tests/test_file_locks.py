@@ -0,0 +1,54 @@
+# قفل الملف وقفل ذاكرة القراءة يؤخذان بنفس الترتيب في كل المسارات: كاتب يحجز الملف ثم يقرأ،
+# وقارئ آخر فاتته الذاكرة في نفس اللحظة، يجب أن ينتهيا معاً بدل أن ينتظر كل منهما الآخر
+import importlib
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("ATTENDANCE_SWEEP_SECONDS", "0")
+    monkeypatch.syspath_prepend(APP_DIR)
+    sys.modules.pop("app", None)
+    module = importlib.import_module("app")
+    yield module
+    sys.modules.pop("app", None)
+
+
+def run_writer_with_concurrent_reader(app, file_path, columns, write):
+    # الكاتب يحجز قفل الملف ثم يتوقف قبل load_data حتى يبدأ القارئ قراءته (والذاكرة فارغة)
+    real_load = app.load_data
+    reader_started = threading.Event()
+
+    def paused_load(*args):
+        reader_started.wait(5); time.sleep(0.2)
+        return real_load(*args)
+
+    app.load_data = paused_load
+    app.invalidate_cache()
+    writer = threading.Thread(target=write, daemon=True)
+    reader = threading.Thread(target=lambda: (reader_started.set(), real_load(file_path, columns)), daemon=True)
+    writer.start(); time.sleep(0.1); reader.start()
+    writer.join(10); reader.join(10)
+    app.load_data = real_load
+    assert not writer.is_alive() and not reader.is_alive(), "deadlock"
+
+
+def test_modify_data_with_concurrent_reader(app):
+    run_writer_with_concurrent_reader(app, app.SETTINGS_FILE, app.DATA_FILES[app.SETTINGS_FILE],
+                                      lambda: app.update_settings(timeout=9))
+    assert int(app.read_settings()["timeout"]) == 9
+
+
+def test_mark_as_read_with_concurrent_reader(app):
+    app.send_message("admin", "ali", "مرحبا")
+    app._get_chat_index()["sig"] = None  # الفهرس يُبنى من الملف داخل mark_as_read
+    run_writer_with_concurrent_reader(app, app.CHAT_FILE, app.CHAT_COLUMNS, lambda: app.mark_as_read("ali", "admin"))
+    assert app.get_unread_count("ali", "admin") == 0